@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Optional, Tuple
+
+import chess
+
+from botlog import log
+
+try:
+    from config import (ADJUDICATE_RESIGN, ADJUDICATE_RESIGN_SCORE, ADJUDICATE_RESIGN_MOVES,
+                        ADJUDICATE_RESIGN_MIN_MOVES, ADJUDICATE_DRAW, ADJUDICATE_DRAW_SCORE,
+                        ADJUDICATE_DRAW_MOVES, ADJUDICATE_DRAW_MIN_MOVES, ADJUDICATE_DRAW_OFFER_EVERY,
+                        SYZYGY_PATH, SYZYGY_MAX_PIECES)
+except ImportError:
+    ADJUDICATE_RESIGN, ADJUDICATE_RESIGN_SCORE, ADJUDICATE_RESIGN_MOVES, ADJUDICATE_RESIGN_MIN_MOVES = True, -1000, 5, 20
+    ADJUDICATE_DRAW, ADJUDICATE_DRAW_SCORE, ADJUDICATE_DRAW_MOVES = True, 15, 8
+    ADJUDICATE_DRAW_MIN_MOVES, ADJUDICATE_DRAW_OFFER_EVERY = 40, 10
+    SYZYGY_PATH, SYZYGY_MAX_PIECES = "", 6
+
+# actions
+RESIGN = "resign"
+OFFER_DRAW = "offer_draw"
+ACCEPT_DRAW = "accept_draw"
+
+
+class Adjudicator:
+    """
+    Decides when a game is settled: resign a lost game, offer or accept a draw in a dead
+    one. Uses the eval history of the game's SearchContext (our POV, one entry per move we
+    played) and, when SYZYGY_PATH is set, exact tablebase results.
+    """
+
+    def __init__(self, resign: bool = ADJUDICATE_RESIGN, resign_score: int = ADJUDICATE_RESIGN_SCORE,
+                 resign_moves: int = ADJUDICATE_RESIGN_MOVES, resign_min_moves: int = ADJUDICATE_RESIGN_MIN_MOVES,
+                 draw: bool = ADJUDICATE_DRAW, draw_score: int = ADJUDICATE_DRAW_SCORE,
+                 draw_moves: int = ADJUDICATE_DRAW_MOVES, draw_min_moves: int = ADJUDICATE_DRAW_MIN_MOVES,
+                 draw_offer_every: int = ADJUDICATE_DRAW_OFFER_EVERY,
+                 syzygy_path: Optional[str] = SYZYGY_PATH, syzygy_max_pieces: int = SYZYGY_MAX_PIECES) -> None:
+        self.resign = resign
+        self.resign_score = resign_score
+        self.resign_moves = max(1, int(resign_moves))
+        self.resign_min_moves = resign_min_moves
+        self.draw = draw
+        self.draw_score = abs(draw_score)
+        self.draw_moves = max(1, int(draw_moves))
+        self.draw_min_moves = draw_min_moves
+        self.draw_offer_every = max(1, int(draw_offer_every))
+        self.syzygy_path = syzygy_path
+        self.syzygy_max_pieces = syzygy_max_pieces
+        self._tablebase: Any = None
+        self._tb_lock = threading.Lock()
+        self._tb_failed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.resign or self.draw
+
+    # -------------------------
+    # tablebase
+    # -------------------------
+    def _open_tablebase(self) -> Any:
+        if self._tablebase is None and not self._tb_failed:
+            try:
+                import chess.syzygy  # โหลดเฉพาะเมื่อตั้ง SYZYGY_PATH
+
+                self._tablebase = chess.syzygy.open_tablebase(self.syzygy_path)
+            except Exception as e:
+                self._tb_failed = True
+                log("adjudication", f"[adjudication] cannot open tablebase {self.syzygy_path}: {e}", level="warning")
+        return self._tablebase
+
+    def tablebase_wdl(self, board: chess.Board) -> Optional[int]:
+        """WDL for the side to move (2 win .. -2 loss; ±1 = decided only past the 50-move rule), or None."""
+        if not self.syzygy_path or not os.path.isdir(self.syzygy_path):
+            return None
+        if chess.popcount(board.occupied) > self.syzygy_max_pieces or board.castling_rights:
+            return None
+        with self._tb_lock:
+            tablebase = self._open_tablebase()
+            if tablebase is None:
+                return None
+            return tablebase.get_wdl(board)
+
+    # -------------------------
+    # policy
+    # -------------------------
+    def decide(self, board: chess.Board, ctx: Any, draw_offered: bool = False) -> Tuple[Optional[str], str]:
+        """
+        Called on our turn before searching. Returns (action, reason) where action is
+        RESIGN / OFFER_DRAW / ACCEPT_DRAW or None (just play on).
+        """
+        if not self.enabled:
+            return None, ""
+        moves = ctx.moves_played
+
+        wdl = self.tablebase_wdl(board)
+        if wdl is not None:
+            if wdl == -2 and self.resign:
+                return RESIGN, "tablebase loss"
+            if abs(wdl) <= 1 and self.draw:
+                if draw_offered:
+                    return ACCEPT_DRAW, f"tablebase draw (wdl={wdl})"
+                if self._may_offer(ctx):
+                    return OFFER_DRAW, f"tablebase draw (wdl={wdl})"
+            # ผลจาก tablebase แน่นอนกว่า eval -> ไม่ต้องดู eval ต่อ
+            return None, ""
+
+        if self.resign and moves >= self.resign_min_moves:
+            recent = ctx.evals.values(self.resign_moves)
+            if len(recent) >= self.resign_moves and max(recent) <= self.resign_score:
+                return RESIGN, f"eval <= {self.resign_score} for {self.resign_moves} moves (last {recent[-1]})"
+
+        if self.draw and moves >= self.draw_min_moves:
+            recent = ctx.evals.values(self.draw_moves)
+            if len(recent) >= self.draw_moves:
+                # รับเสมอเมื่อเราไม่ได้ดีกว่า, ขอเสมอเองเมื่อ eval นิ่งใกล้ 0
+                if draw_offered and max(recent) <= self.draw_score:
+                    return ACCEPT_DRAW, f"eval <= {self.draw_score} for {self.draw_moves} moves (last {recent[-1]})"
+                if max(abs(e) for e in recent) <= self.draw_score and self._may_offer(ctx):
+                    return OFFER_DRAW, f"|eval| <= {self.draw_score} for {self.draw_moves} moves"
+        return None, ""
+
+    def _may_offer(self, ctx: Any) -> bool:
+        last = ctx.draw_offered_at
+        return last is None or ctx.moves_played - last >= self.draw_offer_every
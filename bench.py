@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import chess
+import chess.engine
+
+from engine import Engine
+
+# -------------------------
+# fixed position suite
+# -------------------------
+SUITE: Dict[str, List[str]] = {
+    "opening": [
+        chess.STARTING_FEN,
+        "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+        "r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3",
+    ],
+    "middlegame": [
+        "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9",
+        "r2q1rk1/1b1nbppp/p2ppn2/1p6/3NP3/1BN1BP2/PPPQ2PP/2KR3R w - - 0 12",
+        "2rq1rk1/pb2bppp/1pn1pn2/2pp4/3P4/1PNBPN2/PB3PPP/2RQ1RK1 w - - 0 12",
+    ],
+    "tactical": [
+        "r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1",
+        "2r3k1/p4p2/3Rp2p/1p2P1pK/8/1P4P1/P3Q2P/1q6 b - - 0 1",
+        "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+    ],
+    "endgame": [
+        "8/8/4k3/8/2p5/8/B2K4/8 w - - 0 1",
+        "8/5pk1/6p1/8/5P2/6PK/8/8 w - - 0 1",
+        "8/8/1p6/p1p5/P1P2k2/1P6/5K2/8 w - - 0 1",
+    ],
+}
+
+MOVETIMES = (0.05, 0.1, 0.5)
+
+# regression tolerances when comparing against a baseline
+NPS_TOLERANCE = 0.05          # nps ลดลงเกิน 5% = regression
+OVERSHOOT_TOLERANCE_MS = 20   # overshoot เพิ่มขึ้นเกิน 20ms = regression
+
+
+def _boards(suite: Dict[str, List[str]] = SUITE):
+    for category, fens in suite.items():
+        for fen in fens:
+            yield category, chess.Board(fen)
+
+
+def _make_engine(path: str, threads: int, hash_mb: int) -> Engine:
+    engine = Engine(path=path, skill_level=20, threads=threads, hash_mb=hash_mb, lazy=True)
+    engine.warm_up()
+    return engine
+
+
+# -------------------------
+# measurements
+# -------------------------
+def bench_first_move(path: str, threads: int, hash_mb: int) -> Dict[str, float]:
+    """Cold start: spawn + configure + isready + first bestmove (depth 1)."""
+    t0 = time.monotonic()
+    engine = _make_engine(path, threads, hash_mb)
+    t1 = time.monotonic()
+    try:
+        engine._engine.play(chess.Board(), chess.engine.Limit(depth=1))
+        t2 = time.monotonic()
+    finally:
+        engine.close()
+    return {
+        "warm_up_ms": round((t1 - t0) * 1000, 1),
+        "first_move_ms": round((t2 - t0) * 1000, 1),
+        **engine.startup_timings,
+    }
+
+
+def bench_nps(engine: Engine, movetime: float) -> Dict[str, Any]:
+    """Nodes/sec per category with a fixed think time."""
+    per_category: Dict[str, List[float]] = {}
+    for category, board in _boards():
+        info = engine._engine.analyse(board, chess.engine.Limit(time=movetime), info=chess.engine.INFO_BASIC)
+        nodes, elapsed = info.get("nodes"), info.get("time")
+        nps = info.get("nps") or (nodes / elapsed if nodes and elapsed else 0)
+        per_category.setdefault(category, []).append(float(nps))
+    result = {cat: round(statistics.mean(v)) for cat, v in per_category.items()}
+    result["all"] = round(statistics.mean(v for vals in per_category.values() for v in vals))
+    return result
+
+
+def bench_time_accuracy(engine: Engine, movetimes=MOVETIMES) -> Dict[str, Any]:
+    """Overshoot between requested Limit(time=...) and wall time of play()."""
+    result = {}
+    for movetime in movetimes:
+        overshoot = []
+        for _, board in _boards():
+            t0 = time.monotonic()
+            engine._engine.play(board, chess.engine.Limit(time=movetime))
+            overshoot.append((time.monotonic() - t0 - movetime) * 1000)
+        result[str(movetime)] = {
+            "mean_ms": round(statistics.mean(overshoot), 1),
+            "max_ms": round(max(overshoot), 1),
+        }
+    return result
+
+
+def bench_concurrency(path: str, threads: int, hash_mb: int, pool: int, movetime: float) -> Dict[str, Any]:
+    """Run the suite on 1..pool engines in parallel; report total nodes/sec and moves/sec."""
+    result = {}
+    boards = [b for _, b in _boards()]
+    for n in range(1, pool + 1):
+        engines = [_make_engine(path, threads, hash_mb) for _ in range(n)]
+        totals = [0] * n
+        errors: List[str] = []
+
+        def worker(i: int) -> None:
+            try:
+                for board in boards:
+                    info = engines[i]._engine.analyse(board, chess.engine.Limit(time=movetime), info=chess.engine.INFO_BASIC)
+                    totals[i] += int(info.get("nodes") or 0)
+            except Exception as e:
+                errors.append(str(e))
+
+        t0 = time.monotonic()
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.monotonic() - t0
+        for e in engines:
+            e.close()
+        result[str(n)] = {
+            "nps": round(sum(totals) / elapsed) if elapsed else 0,
+            "moves_per_sec": round(n * len(boards) / elapsed, 2) if elapsed else 0,
+            "errors": len(errors),
+        }
+    return result
+
+
+def run(path: str, threads: int = 1, hash_mb: int = 64, pool: int = 2, movetime: float = 0.2) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "meta": {
+            "path": path,
+            "threads": threads,
+            "hash_mb": hash_mb,
+            "pool": pool,
+            "movetime": movetime,
+            "positions": sum(len(v) for v in SUITE.values()),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+        },
+    }
+    results["first_move"] = bench_first_move(path, threads, hash_mb)
+    engine = _make_engine(path, threads, hash_mb)
+    try:
+        results["meta"]["engine"] = engine._engine.id.get("name", "")
+        results["nps"] = bench_nps(engine, movetime)
+        results["time_accuracy"] = bench_time_accuracy(engine)
+    finally:
+        engine.close()
+    results["concurrency"] = bench_concurrency(path, threads, hash_mb, pool, movetime)
+    return results
+
+
+# -------------------------
+# baseline comparison
+# -------------------------
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Return human-readable regressions of `results` vs `baseline` (empty = ok)."""
+    regressions = []
+    for key, base in baseline.get("nps", {}).items():
+        cur = results.get("nps", {}).get(key)
+        if cur is not None and base and cur < base * (1 - NPS_TOLERANCE):
+            regressions.append(f"nps[{key}] {cur} < baseline {base} (-{(1 - cur / base) * 100:.1f}%)")
+    for key, base in baseline.get("concurrency", {}).items():
+        cur = results.get("concurrency", {}).get(key)
+        if cur is not None and base.get("nps") and cur["nps"] < base["nps"] * (1 - NPS_TOLERANCE):
+            regressions.append(f"concurrency[{key}] nps {cur['nps']} < baseline {base['nps']}")
+    for key, base in baseline.get("time_accuracy", {}).items():
+        cur = results.get("time_accuracy", {}).get(key)
+        if cur is not None and cur["mean_ms"] > base["mean_ms"] + OVERSHOOT_TOLERANCE_MS:
+            regressions.append(f"overshoot[{key}s] {cur['mean_ms']}ms > baseline {base['mean_ms']}ms")
+    base_first = baseline.get("first_move", {}).get("first_move_ms")
+    cur_first = results.get("first_move", {}).get("first_move_ms")
+    if base_first and cur_first and cur_first > base_first * 1.5 + 100:
+        regressions.append(f"first_move {cur_first}ms > baseline {base_first}ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    try:
+        from config import STOCKFISH_PATH
+    except ImportError:
+        STOCKFISH_PATH = "stockfish"
+
+    parser = argparse.ArgumentParser(description="Engine throughput benchmark")
+    parser.add_argument("--path", default=None, help="Stockfish binary (default: discovery)")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--hash", dest="hash_mb", type=int, default=64)
+    parser.add_argument("--pool", type=int, default=2, help="max engines for the concurrency test")
+    parser.add_argument("--movetime", type=float, default=0.2)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args(argv)
+
+    path = args.path
+    if path is None:
+        from discovery import discover
+        path, _ = discover(STOCKFISH_PATH)
+
+    results = run(path, args.threads, args.hash_mb, args.pool, args.movetime)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(json.dumps({k: v for k, v in results.items() if k != "meta"}, indent=1))
+    print(f"[bench] results written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"[bench] baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"[bench] no baseline at {args.baseline} (use --save-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    for r in regressions:
+        print(f"[bench] REGRESSION: {r}")
+    if not regressions:
+        print("[bench] no regressions vs baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
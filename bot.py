@@ -3,48 +3,128 @@ import time
 import traceback
 import sys
 import os
-import shutil
+import functools
+import signal
 
 import berserk
 import berserk.exceptions
 import requests
 import chess
+import chess.polyglot
 
 from config import TOKEN, POLL_INTERVAL, STOCKFISH_PATH
-from engine import Engine  
+from config import CONTEXT_HISTORY, ENGINE_START_ATTEMPTS, ENGINE_READY_WAIT
+from config import DRAIN_TIMEOUT, DRAIN_MAX_MOVE_TIME, DRAIN_HANDOFF, DRAIN_REPORT_INTERVAL
+from config import EXPERIENCE_ENABLED, EXPERIENCE_PATH, EXPERIENCE_MAX_ENTRIES, EXPERIENCE_MAX_PLY
+from engine import Engine, SearchContext
+from discovery import cached_choice, discover
+from experience import ExperienceBook
+from adjudication import Adjudicator, RESIGN, OFFER_DRAW
+from botlog import log, log_move, log_game, stop as stop_logging
+import profiler
+from profiler import timed
 
 client = None
+engine_inst = None
+engine_ready = threading.Event()  # set เมื่อ engine warm-up สำเร็จ (ถ้าล้มเหลวทุกครั้ง -> ออกจากโปรแกรม)
+startup_timings = {}  # ms: discover / client / engine spawn, configure, isready / experience
+draining = threading.Event()  # set เมื่อเริ่ม drain: ไม่รับ challenge ใหม่
+stop_now = threading.Event()  # set เมื่อได้สัญญาณครั้งที่สอง: ออกทันที
+_drain_reason = "signal"
+active_games = {}  # game_id -> handler thread
+_active_lock = threading.Lock()
 
 # ------- Stockfish Auto-Discovery -------
+@functools.lru_cache(maxsize=None)
 def check_stockfish(configured_path):
-    """Check if stockfish is available in configured path, PATH, or current folder."""
-    if configured_path and os.path.exists(configured_path):
-        return configured_path
-        
-    for name in ["stockfish", "stockfish.exe", "stockfish_15", "stockfish-windows-x86-64-avx2.exe"]:
-        if os.path.exists(name):
-            return os.path.abspath(name)
-    
-    path = shutil.which("stockfish")
-    if path:
-        return path
-    return configured_path # fallback
+    """
+    Pick a Stockfish from configured path, current folder or PATH without probing:
+    the fastest one already benchmarked (cache keyed by binary hash), else the first found.
+    Returns (path, capabilities).
+    """
+    try:
+        return cached_choice(configured_path)
+    except Exception as e:
+        log("discovery", f"[discovery] failed: {e}", level="warning")
+        return configured_path, None # fallback
+
+def _refresh_discovery(current_path):
+    """After the engine is up: probe + benchmark binaries not in the cache yet (used from the next start)."""
+    try:
+        best_path, _ = discover(STOCKFISH_PATH)
+    except Exception as e:
+        log("discovery", f"[discovery] failed: {e}", level="warning")
+        return
+    if best_path and os.path.abspath(best_path) != os.path.abspath(current_path or ""):
+        log("discovery", f"[discovery] faster build {best_path} will be used on next start")
+
+# ------- Experience book (โหลดก่อนเปิด event stream) -------
+experience_book = ExperienceBook(max_entries=EXPERIENCE_MAX_ENTRIES) if EXPERIENCE_ENABLED else None
+
+def _load_experience():
+    t0 = time.monotonic()
+    experience_book.path = EXPERIENCE_PATH
+    if os.path.exists(EXPERIENCE_PATH):
+        experience_book.load(EXPERIENCE_PATH)
+    startup_timings["experience_ms"] = round((time.monotonic() - t0) * 1000, 1)
+    log("startup", f"[*] Experience book: {len(experience_book)} entries ({EXPERIENCE_PATH})")
+
+# ------- Adjudication (resign / draw เมื่อผลเกมชัดแล้ว) -------
+adjudicator = Adjudicator()
 
 # ------- Instantiate engine -------
-def _make_engine_instance():
-    sf_path = check_stockfish(STOCKFISH_PATH)
-    print(f"[*] Using Stockfish at: {sf_path}")
+def _make_engine_instance(sf_path, capabilities=None):
     try:
         # ใช้ Engine พร้อม Dynamic Time Management
-        return Engine(path=sf_path, skill_level=20)
+        engine = Engine(path=sf_path, skill_level=20, experience=experience_book, lazy=True,
+                        capabilities=capabilities)
+        engine.warm_up()
+        return engine
     except Exception as e:
-        print(f"[!] Warning: Engine start failed: {e}. Attempting simple init.")
+        log("engine_start", f"[!] Warning: Engine start failed: {e}. Attempting simple init.", level="warning")
         try:
-            return Engine()
+            engine = Engine(experience=experience_book, lazy=True)
+            engine.warm_up()
+            return engine
         except:
             raise RuntimeError(f"ไม่สามารถสร้าง Engine instance ได้: {e}")
 
-engine_inst = _make_engine_instance()
+def _warm_up_engine(started):
+    """Background: discover + spawn + configure + isready, then report the startup breakdown."""
+    global engine_inst
+    t0 = time.monotonic()
+    sf_path, capabilities = check_stockfish(STOCKFISH_PATH)
+    startup_timings["discover_ms"] = round((time.monotonic() - t0) * 1000, 1)
+    log("startup", f"[*] Using Stockfish at: {sf_path}")
+    if capabilities is not None:
+        log("startup", f"[*] Stockfish build: {capabilities.summary()}")
+    for attempt in range(1, ENGINE_START_ATTEMPTS + 1):
+        try:
+            engine = _make_engine_instance(sf_path, capabilities)
+            break
+        except Exception as e:
+            log("engine_start", f"[!] engine start attempt {attempt}/{ENGINE_START_ATTEMPTS} failed: {e}", level="error")
+            if attempt == ENGINE_START_ATTEMPTS:
+                # bot ที่ไม่มี engine เล่นไม่ได้ -> ออกเลย (แบบเดียวกับ baseline ที่หยุดตอน import)
+                log("engine_start", "[!] cannot start Stockfish; exiting", level="error")
+                shutdown(1)
+            time.sleep(2.0 * attempt)
+    if draining.is_set():
+        engine.max_move_time = DRAIN_MAX_MOVE_TIME
+    engine_inst = engine
+    startup_timings.update(engine.startup_timings)
+    startup_timings["ready_ms"] = round((time.monotonic() - started) * 1000, 1)
+    engine_ready.set()
+    log("startup", f"[*] Startup: {startup_timings}", **startup_timings)
+    _refresh_discovery(sf_path)
+
+def _engine_available():
+    return engine_ready.is_set() and engine_inst is not None
+
+def _wait_for_engine():
+    """Block until the engine finished warming up (games may start before that)."""
+    engine_ready.wait()
+    return engine_inst
 
 # ------- client/session helper -------
 def create_client():
@@ -57,11 +137,26 @@ def create_client():
     client = berserk.Client(session=session)
     return client
 
-# create initial client
-create_client()
+# ------- startup -------
+def startup():
+    """
+    Start Stockfish discovery + engine warm-up in the background, load the experience
+    book and create the client, so the event stream can open right away.
+    """
+    started = time.monotonic()
+    threading.Thread(target=_warm_up_engine, args=(started,), name="engine-warmup", daemon=True).start()
+    # โหลดให้เสร็จก่อนเริ่มเกม: load() แทนที่ข้อมูลทั้งหมด -> เกมที่บันทึกก่อนหน้านั้นจะหาย
+    if experience_book is not None:
+        _load_experience()
+
+    t0 = time.monotonic()
+    create_client()
+    startup_timings["client_ms"] = round((time.monotonic() - t0) * 1000, 1)
 
 # ------- Engine call wrapper (Simplified & Robust) -------
-def call_engine_for_move(game_state):
+@timed()
+def call_engine_for_move(game_state, ctx=None):
+    """Choose a move for `game_state`. `ctx` is the game's SearchContext (history, PV, engine)."""
     # Extract clock info if available
     wtime, btime, winc, binc = None, None, None, None
     
@@ -73,26 +168,44 @@ def call_engine_for_move(game_state):
         binc = state.get("binc")
 
     board = _board_from_game_state(game_state)
+    engine = ctx.engine if ctx is not None and ctx.engine is not None else _wait_for_engine()
+    if engine is None:
+        log("engine_error", "[engine] engine is not available", level="error")
+        return None
+    if ctx is not None:
+        ctx.engine = engine
+    search_info = ctx.begin() if ctx is not None else None
+    if search_info is not None:
+        search_info["key"] = chess.polyglot.zobrist_hash(board)
+        search_info["ply"] = board.ply()
+    t0 = time.monotonic()
     
     try:
         # พยายามใช้การคำนวณแบบ Dynamic ก่อน
-        move_uci = engine_inst._choose_move_from_board(
+        move_uci = engine._choose_move_from_board(
             board, 
             wtime=wtime, 
             btime=btime, 
             winc=winc, 
-            binc=binc
+            binc=binc,
+            search_info=search_info,
+            ctx=ctx
         )
         if move_uci:
+            if search_info is not None:
+                search_info["think_time"] = time.monotonic() - t0
             return move_uci
     except Exception as e:
-        print(f"[engine] dynamic choice failed: {e}")
+        log("engine_error", f"[engine] dynamic choice failed: {e}", level="warning")
 
     # Fallback: ใช้ simple move แบบเวอร์ชันเก่าที่เสถียร
     try:
-        return engine_inst._choose_move_from_board(board, depth=15)
+        move_uci = engine._choose_move_from_board(board, depth=15, search_info=search_info)
+        if search_info is not None:
+            search_info["think_time"] = time.monotonic() - t0
+        return move_uci
     except Exception as e:
-        print(f"[engine] fallback failed: {e}")
+        log("engine_error", f"[engine] fallback failed: {e}", level="error")
         return None
 
 # ------- helper: parse/board -------
@@ -109,6 +222,43 @@ def _parse_moves_from_state(state):
     return str(state) if isinstance(state, str) else ""
 
 
+def _parse_result_from_state(state):
+    """Return (status, winner) from a gameFull/gameState/export payload."""
+    if not isinstance(state, dict):
+        return None, None
+    if "state" in state and isinstance(state["state"], dict):
+        state = state["state"]
+    return state.get("status"), state.get("winner")
+
+
+def _parse_players_from_state(state):
+    """Return PGN White/Black headers from a gameFull payload (or {})."""
+    if not isinstance(state, dict) or state.get("type") != "gameFull":
+        return {}
+    headers = {}
+    for color, tag in (("white", "White"), ("black", "Black")):
+        player = state.get(color) or {}
+        name = player.get("name") or player.get("id") or ("Stockfish AI" if "aiLevel" in player else None)
+        if name:
+            headers[tag] = name
+        if player.get("rating"):
+            headers[f"{tag}Elo"] = str(player["rating"])
+    return headers
+
+
+def _pgn_result(status, winner):
+    if status in (None, "started", "created"):
+        return "*"
+    if winner == "white":
+        return "1-0"
+    if winner == "black":
+        return "0-1"
+    if status in ("aborted", "noStart", "unknownFinish"):
+        return "*"
+    return "1/2-1/2"
+
+
+@timed()
 def _board_from_game_state(game_state):
     if isinstance(game_state, str):
         if "/" in game_state and " " in game_state:
@@ -141,6 +291,7 @@ def _board_from_game_state(game_state):
 
 
 # ------- safe move sender -------
+@timed()
 def make_move_safe(game_id: str, move: str, max_retries: int = 3, retry_delay: float = 1.0) -> bool:
     """
     พยายามส่ง move ซ้ำ ๆ ถ้ามีปัญหา network (ไม่ใช่ข้อผิดพลาดแบบ 'Not your turn').
@@ -154,58 +305,182 @@ def make_move_safe(game_id: str, move: str, max_retries: int = 3, retry_delay: f
             # ถ้าเป็นข้อผิดพลาดว่า "Not your turn" หรือ "Invalid UCI" -> ไม่ retry
             msg = str(err)
             if "Not your turn" in msg or "Invalid UCI" in msg or "is not your game" in msg:
-                print(f"[{game_id}] make_move failed (non-retryable): {err}")
+                log("move_rejected", f"[{game_id}] make_move failed (non-retryable): {err}", level="warning", game_id=game_id)
                 return False
             # network-related or server errors -> retry
-            print(f"[{game_id}] make_move attempt {attempt} failed: {err}. retrying in {retry_delay}s...")
+            log("move_retry", f"[{game_id}] make_move attempt {attempt} failed: {err}. retrying in {retry_delay}s...", level="warning", game_id=game_id)
             time.sleep(retry_delay)
         except requests.exceptions.RequestException as e:
-            print(f"[{game_id}] network error when making move: {e}. retrying in {retry_delay}s...")
+            log("move_retry", f"[{game_id}] network error when making move: {e}. retrying in {retry_delay}s...", level="warning", game_id=game_id)
             time.sleep(retry_delay)
         except Exception as e:
-            print(f"[{game_id}] unexpected error in make_move: {e}")
+            log("move_retry", f"[{game_id}] unexpected error in make_move: {e}", level="warning", game_id=game_id)
             time.sleep(retry_delay)
     return False
 
 
+# ------- adjudication -------
+def _parse_draw_offer(state, my_color):
+    """True when the opponent currently offers a draw (gameState wdraw / bdraw)."""
+    if not isinstance(state, dict):
+        return False
+    if "state" in state and isinstance(state["state"], dict):
+        state = state["state"]
+    return bool(state.get("bdraw" if my_color == "white" else "wdraw"))
+
+
+def _offer_draw(game_id):
+    """Offer (or accept) a draw. berserk มี draw endpoint แค่ของ board API -> เรียก bot endpoint ตรง"""
+    client.bots._r.post(f"/api/bot/game/{game_id}/draw/yes")
+
+
+def _game_action(game_id, action):
+    """
+    Send resign / draw offer (or acceptance) through the Bot API. Returns True on success.
+    Never raises: a failed adjudication must not stop the normal move.
+    """
+    try:
+        if action == RESIGN:
+            client.bots.resign_game(game_id)
+        else:
+            _offer_draw(game_id)
+        return True
+    except Exception as e:  # ResponseError / ApiError (network) / ...
+        log("adjudication", f"[handler:{game_id}] {action} failed: {e}", level="warning", game_id=game_id, action=action)
+        return False
+
+
+def _adjudicate(game_id, my_color, state, ctx):
+    """
+    Consult the adjudicator before searching. Returns True when we resigned or accepted a
+    draw (no move needed); a draw offer is sent alongside the normal move.
+    """
+    if not adjudicator.enabled:
+        return False
+    try:
+        board = _board_from_game_state(state)
+        action, reason = adjudicator.decide(board, ctx, _parse_draw_offer(state, my_color))
+    except Exception as e:
+        log("adjudication", f"[handler:{game_id}] adjudication failed: {e}", level="warning", game_id=game_id)
+        return False
+    if action is None:
+        return False
+    last_eval = ctx.evals.values(1)
+    ok = _game_action(game_id, action)
+    log("adjudication", f"[handler:{game_id}] {action}: {reason}" + ("" if ok else " (failed)"),
+        game_id=game_id, action=action, reason=reason, ok=ok, moves_played=ctx.moves_played,
+        eval=last_eval[0] if last_eval else None)
+    if action == OFFER_DRAW:
+        if ok:  # ส่งไม่สำเร็จ -> ลองใหม่ตาหน้า ไม่ต้องรอ ADJUDICATE_DRAW_OFFER_EVERY
+            ctx.draw_offered_at = ctx.moves_played
+        return False
+    return ok
+
+
+# ------- experience recording -------
+def _record_experience(game_id, my_color, plies, status, winner):
+    """Store our moves of a finished game into the experience book and persist it."""
+    if experience_book is None or not plies:
+        return
+    # เกมที่ไม่ได้เล่นจริง (abort / ไม่เริ่ม) ไม่มีข้อมูลให้เรียนรู้
+    if status in (None, "started", "created", "aborted", "noStart", "unknownFinish"):
+        return
+    if winner is None:
+        result = 0.5
+    else:
+        result = 1.0 if winner == my_color else 0.0
+    try:
+        stored = experience_book.record_game(plies, result)
+        experience_book.save_async()  # เขียนไฟล์ใน background -> handler ไม่ต้องรอ
+        log("experience", f"[handler:{game_id}] experience: stored {stored} positions (result={result}, book={len(experience_book)})", game_id=game_id)
+    except Exception as e:
+        log("experience_error", f"[handler:{game_id}] experience update failed: {e}", level="warning", game_id=game_id)
+
+
+def _remember_move(game_id, my_color, move, search_info, plies, evals):
+    """Bookkeeping after a move was sent: telemetry, PGN eval and experience plies."""
+    ply = search_info.get("ply")
+    score = search_info.get("score")
+    think_time = search_info.get("think_time")
+    log_move(
+        game_id, ply=ply, move=move, source=search_info.get("source"),
+        think_time=round(think_time, 4) if think_time is not None else None,
+        eval=score, mate=search_info.get("mate"), depth=search_info.get("depth"),
+        nodes=search_info.get("nodes"), nps=search_info.get("nps"),
+    )
+    if ply is not None and score is not None:
+        evals[ply] = score if my_color == "white" else -score
+    if search_info.get("key") is None or (ply or 0) >= EXPERIENCE_MAX_PLY:
+        return
+    plies.append((search_info["key"], move, score))
+
+
 # ------- game handler -------
 def handle_game(game_id: str, my_color: str):
-    print(f"[handler] start game handler {game_id} (color={my_color})")
+    """Run one game; registered in active_games so draining can wait for it."""
+    with _active_lock:
+        active_games.setdefault(game_id, threading.current_thread())
+    try:
+        _handle_game(game_id, my_color)
+    finally:
+        with _active_lock:
+            active_games.pop(game_id, None)
+
+
+def _handoff(game_id):
+    """True when draining with handoff: leave the game to the successor process."""
+    if DRAIN_HANDOFF and draining.is_set():
+        log("drain", f"[handler:{game_id}] handing game over to successor process", game_id=game_id)
+        return True
+    return False
+
+
+def _handle_game(game_id: str, my_color: str):
+    log("game_start", f"[handler] start game handler {game_id} (color={my_color})", game_id=game_id)
     last_processed_moves_count = -1
+    plies = []  # (zobrist key, move, eval) ของตาที่เราเดิน -> experience book
+    ctx = SearchContext(game_id, my_color, engine=engine_inst, history=CONTEXT_HISTORY)  # engine_inst may still be warming up
+    status, winner = None, None
+    moves_str = ""
+    headers = {}  # PGN headers (ชื่อผู้เล่น) จาก gameFull
+    evals = {}  # ply -> eval (cp, มุมมองฝ่ายขาว) สำหรับ PGN
+    handed_off = False
 
     # Try using streaming game state (preferred)
     try:
         stream = client.bots.stream_game_state(game_id)
     except Exception as e:
-        print(f"[handler:{game_id}] cannot open game stream: {e}")
+        log("stream_error", f"[handler:{game_id}] cannot open game stream: {e}", level="warning", game_id=game_id)
         stream = None
 
     if stream:
         try:
             for state in stream:
                 try:
+                    headers.update(_parse_players_from_state(state))
                     moves_str = _parse_moves_from_state(state)
                     moves_list = moves_str.split() if moves_str else []
                     moves_count = len(moves_list)
 
-                    status = None
-                    if isinstance(state, dict):
-                        if "state" in state and isinstance(state["state"], dict):
-                            status = state["state"].get("status")
-                        else:
-                            status = state.get("status")
+                    status, winner = _parse_result_from_state(state)
 
                     if status and status != "started":
-                        print(f"[handler:{game_id}] เกมจบ (status={status})")
+                        log("game_over", f"[handler:{game_id}] เกมจบ (status={status})", game_id=game_id)
+                        break
+                    if _handoff(game_id):
+                        handed_off = True
                         break
 
                     to_move_color = "white" if (moves_count % 2 == 0) else "black"
 
                     if to_move_color == my_color and last_processed_moves_count != moves_count:
+                        if _adjudicate(game_id, my_color, state, ctx):
+                            last_processed_moves_count = moves_count
+                            continue
                         try:
-                            move = call_engine_for_move(state)
+                            move = call_engine_for_move(state, ctx)
                         except Exception as e:
-                            print(f"[{game_id}] engine exception: {e}")
+                            log("engine_error", f"[{game_id}] engine exception: {e}", level="error", game_id=game_id)
                             move = None
 
                         # Validate move
@@ -213,86 +488,203 @@ def handle_game(game_id: str, my_color: str):
                             try:
                                 chess.Move.from_uci(move)
                             except Exception:
-                                print(f"[{game_id}] engine returned invalid UCI: {move!r}")
+                                log("engine_error", f"[{game_id}] engine returned invalid UCI: {move!r}", level="error", game_id=game_id)
                                 move = None
 
                         if move:
                             ok = make_move_safe(game_id, move)
                             if ok:
-                                print(f"[handler:{game_id}] ส่ง move {move} (moves_count={moves_count})")
+                                log("move_sent", f"[handler:{game_id}] ส่ง move {move} (moves_count={moves_count})", game_id=game_id, move=move)
                                 last_processed_moves_count = moves_count
+                                _remember_move(game_id, my_color, move, ctx.commit() or {}, plies, evals)
                             else:
-                                print(f"[handler:{game_id}] failed to send move {move}")
+                                log("move_failed", f"[handler:{game_id}] failed to send move {move}", level="warning", game_id=game_id)
                         else:
-                            print(f"[handler:{game_id}] engine คืน None (no move).")
+                            log("engine_error", f"[handler:{game_id}] engine คืน None (no move).", level="warning", game_id=game_id)
                 except Exception:
-                    print(f"[handler:{game_id}] error processing state:\n{traceback.format_exc()}")
+                    log("handler_error", f"[handler:{game_id}] error processing state:\n{traceback.format_exc()}", level="error", game_id=game_id)
                     time.sleep(POLL_INTERVAL)
         except Exception as e:
-            print(f"[handler:{game_id}] stream exception (will fallback to polling): {e}")
+            log("stream_error", f"[handler:{game_id}] stream exception (will fallback to polling): {e}", level="warning", game_id=game_id)
             # fall-through to polling
     # Fallback: polling using client.games.export
     try:
-        while True:
+        while (status is None or status == "started") and not handed_off:
+            if _handoff(game_id):
+                handed_off = True
+                break
             try:
                 game_state = client.games.export(game_id)
             except berserk.exceptions.ResponseError as e:
                 # network/server issue - retry after a pause instead of breaking handler
-                print(f"[handler:{game_id}] export error (network/server): {e}. retrying in {POLL_INTERVAL}s")
+                log("stream_error", f"[handler:{game_id}] export error (network/server): {e}. retrying in {POLL_INTERVAL}s", level="warning", game_id=game_id)
                 time.sleep(max(0.5, POLL_INTERVAL))
                 continue
             except requests.exceptions.RequestException as e:
-                print(f"[handler:{game_id}] network error on export: {e}. retrying in {POLL_INTERVAL}s")
+                log("stream_error", f"[handler:{game_id}] network error on export: {e}. retrying in {POLL_INTERVAL}s", level="warning", game_id=game_id)
                 time.sleep(max(0.5, POLL_INTERVAL))
                 continue
             except Exception as e:
-                print(f"[handler:{game_id}] unexpected export error: {e}")
+                log("stream_error", f"[handler:{game_id}] unexpected export error: {e}", level="warning", game_id=game_id)
                 time.sleep(max(0.5, POLL_INTERVAL))
                 continue
 
-            status = game_state.get("status")
+            status, winner = _parse_result_from_state(game_state)
+            moves_str = game_state.get("moves", "") or moves_str
             if status and status != "started":
-                print(f"[handler:{game_id}] เกมจบ (status={status})")
+                log("game_over", f"[handler:{game_id}] เกมจบ (status={status})", game_id=game_id)
                 break
 
-            moves_str = game_state.get("moves", "") or ""
             moves_list = moves_str.split() if moves_str else []
             moves_count = len(moves_list)
 
             to_move_color = "white" if (moves_count % 2 == 0) else "black"
 
             if to_move_color == my_color and last_processed_moves_count != moves_count:
+                if _adjudicate(game_id, my_color, game_state, ctx):
+                    last_processed_moves_count = moves_count
+                    time.sleep(POLL_INTERVAL)
+                    continue
                 try:
-                    move = call_engine_for_move(game_state)
+                    move = call_engine_for_move(game_state, ctx)
                 except Exception as e:
-                    print(f"[{game_id}] engine exception (poll): {e}")
+                    log("engine_error", f"[{game_id}] engine exception (poll): {e}", level="error", game_id=game_id)
                     move = None
 
                 if move and isinstance(move, str):
                     try:
                         chess.Move.from_uci(move)
                     except Exception:
-                        print(f"[{game_id}] engine returned invalid UCI (poll): {move!r}")
+                        log("engine_error", f"[{game_id}] engine returned invalid UCI (poll): {move!r}", level="error", game_id=game_id)
                         move = None
 
                 if move:
                     ok = make_move_safe(game_id, move)
                     if ok:
-                        print(f"[handler:{game_id}] (poll) ส่ง move {move} (moves_count={moves_count})")
+                        log("move_sent", f"[handler:{game_id}] (poll) ส่ง move {move} (moves_count={moves_count})", game_id=game_id, move=move)
                         last_processed_moves_count = moves_count
+                        _remember_move(game_id, my_color, move, ctx.commit() or {}, plies, evals)
                     else:
-                        print(f"[handler:{game_id}] (poll) failed to send move {move}")
+                        log("move_failed", f"[handler:{game_id}] (poll) failed to send move {move}", level="warning", game_id=game_id)
                 else:
-                    print(f"[handler:{game_id}] (poll) engine คืน None")
+                    log("engine_error", f"[handler:{game_id}] (poll) engine คืน None", level="warning", game_id=game_id)
             time.sleep(POLL_INTERVAL)
     except Exception:
-        print(f"[handler:{game_id}] handler exception:\n{traceback.format_exc()}")
+        log("handler_error", f"[handler:{game_id}] handler exception:\n{traceback.format_exc()}", level="error", game_id=game_id)
+
+    if handed_off:
+        # เกมยังไม่จบ -> process ใหม่จะเขียน PGN / experience / game_end เอง
+        return
+    _record_experience(game_id, my_color, plies, status, winner)
+    if moves_str:
+        headers["Result"] = _pgn_result(status, winner)
+        headers["Termination"] = status or "unknown"
+        log_game(game_id, moves_str, headers, evals)
+    if hasattr(ctx.engine, "get_metrics"):
+        metrics = ctx.engine.get_metrics()
+        log("engine_metrics", f"[handler:{game_id}] engine metrics: {metrics}", game_id=game_id, metrics=metrics)
+    log("game_end", f"[handler] end game handler {game_id}", game_id=game_id,
+        moves_played=ctx.moves_played, time_used=round(ctx.time_used, 3))
+
+
+# ------- drain / shutdown -------
+def shutdown(code=0):
+    """Close engines and flush logs, then exit the process."""
+    try:
+        if hasattr(engine_inst, "close"):
+            engine_inst.close()
+    except Exception:
+        pass
+    if experience_book is not None:
+        experience_book.save()  # รอ save_async ที่ค้างอยู่ แล้วเขียนสถานะล่าสุด
+    stop_logging()
+    # main thread อาจค้างอยู่ใน event stream (blocking read) -> ออกจาก process โดยตรง
+    os._exit(code)
+
 
-    print(f"[handler] end game handler {game_id}")
+def _drain_worker(started):
+    deadline = started + DRAIN_TIMEOUT
+    last_report = 0.0
+    while True:
+        with _active_lock:
+            remaining = sorted(active_games)
+        now = time.monotonic()
+        if not remaining:
+            log("drain", f"[drain] all games finished after {now - started:.1f}s; shutting down")
+            break
+        if now >= deadline:
+            log("drain", f"[drain] timeout after {DRAIN_TIMEOUT}s; {len(remaining)} game(s) still active: {remaining}",
+                level="warning", games=remaining)
+            break
+        if now - last_report >= DRAIN_REPORT_INTERVAL:
+            log("drain", f"[drain] waiting for {len(remaining)} game(s): {remaining} ({deadline - now:.0f}s left)",
+                games=remaining, remaining_s=round(deadline - now))
+            last_report = now
+        time.sleep(0.5)
+    shutdown(0)
+
+
+def begin_drain(reason="signal"):
+    """
+    Stop accepting challenges, cap think time and let active games finish (or hand them
+    to a successor when DRAIN_HANDOFF), then shut down. Bounded by DRAIN_TIMEOUT.
+    Only sets flags (safe inside a signal handler); the drain-control thread does the work.
+    """
+    global _drain_reason
+    if draining.is_set():
+        return
+    _drain_reason = reason
+    draining.set()
+
+
+def _start_drain(reason):
+    if engine_inst is not None:
+        engine_inst.max_move_time = DRAIN_MAX_MOVE_TIME
+    with _active_lock:
+        count = len(active_games)
+    log("drain", f"[drain] draining ({reason}): {count} active game(s), handoff={DRAIN_HANDOFF}, "
+        f"max move time {DRAIN_MAX_MOVE_TIME}s, timeout {DRAIN_TIMEOUT}s", reason=reason, games=count)
+    threading.Thread(target=_drain_worker, args=(time.monotonic(),), name="drain", daemon=True).start()
+
+
+def _stop_now():
+    print("Stopping immediately.")
+    shutdown(1)
+
+
+def _drain_control():
+    """Long-lived thread: does the work requested by the signal handler (lock, log, drain, exit)."""
+    draining.wait()
+    _start_drain(_drain_reason)
+    stop_now.wait()
+    _stop_now()
+
+
+def _on_signal(signum, frame):
+    # ใน signal handler ห้ามแตะ lock / log / สร้าง thread: main thread อาจถือ lock อยู่
+    # (_active_lock, คิว log, Thread.start) -> deadlock. แค่ set Event ให้ drain-control ทำงานแทน
+    if draining.is_set():
+        stop_now.set()  # สัญญาณครั้งที่สอง -> หยุดทันที
+        return
+    begin_drain(signal.Signals(signum).name)
+
+
+def _install_signal_handlers():
+    threading.Thread(target=_drain_control, name="drain-control", daemon=True).start()
+    for name in ("SIGTERM", "SIGINT"):
+        sig = getattr(signal, name, None)
+        if sig is not None:
+            try:
+                signal.signal(sig, _on_signal)
+            except (ValueError, OSError):
+                pass  # ไม่ใช่ main thread / platform ไม่รองรับ
 
 
 # ------- main event loop with reconnect/backoff -------
 def main():
+    _install_signal_handlers()
+    profiler.install()
+    startup()
     print("Bot เริ่มทำงาน... รอ challenge...")
     backoff = 1.0  # initial backoff (seconds)
     while True:
@@ -307,20 +699,38 @@ def main():
                     etype = event.get("type")
                     if etype == "challenge":
                         challenge_id = event["challenge"]["id"]
-                        print(f"มี challenge ใหม่: {challenge_id}, ตอบรับ...")
+                        # engine ยัง warm-up ไม่เสร็จ -> รอสักครู่ ถ้ายังไม่พร้อมก็ปฏิเสธ (later)
+                        if not _engine_available():
+                            engine_ready.wait(ENGINE_READY_WAIT)
+                        if draining.is_set() or not _engine_available():
+                            reason = "draining" if draining.is_set() else "engine not ready"
+                            log("challenge", f"[main] ปฏิเสธ challenge {challenge_id} ({reason})")
+                            try:
+                                client.bots.decline_challenge(challenge_id, reason="later")
+                            except berserk.exceptions.ResponseError as e:
+                                log("challenge_error", f"ไม่สามารถปฏิเสธ challenge: {e}", level="warning")
+                            continue
+                        log("challenge", f"มี challenge ใหม่: {challenge_id}, ตอบรับ...")
                         try:
                             client.bots.accept_challenge(challenge_id)
                         except berserk.exceptions.ResponseError as e:
-                            print(f"ไม่สามารถตอบรับ challenge: {e}")
+                            log("challenge_error", f"ไม่สามารถตอบรับ challenge: {e}", level="warning")
                         continue
 
                     if etype == "gameStart":
                         game_id = event["game"]["id"]
                         my_color = event["game"].get("color")  # "white" or "black"
-                        t = threading.Thread(target=handle_game, args=(game_id, my_color), daemon=True)
+                        if DRAIN_HANDOFF and draining.is_set():
+                            continue
+                        with _active_lock:
+                            # reconnect แล้ว Lichess ส่ง gameStart ของเกมที่เล่นอยู่ซ้ำ -> ไม่เปิด handler ซ้อน
+                            if game_id in active_games:
+                                continue
+                            t = threading.Thread(target=handle_game, args=(game_id, my_color), daemon=True)
+                            active_games[game_id] = t
                         t.start()
                 except Exception:
-                    print(f"error in main event loop event processing:\n{traceback.format_exc()}")
+                    log("main_error", f"error in main event loop event processing:\n{traceback.format_exc()}", level="error")
 
             # if loop exits normally (rare), reset backoff and loop again
             backoff = 1.0
@@ -329,25 +739,20 @@ def main():
                 berserk.exceptions.ResponseError,
                 Exception) as e:
             # Generic catch: print, sleep with exponential backoff, recreate client, and retry
-            print(f"[main] stream error / disconnected: {e}")
-            print(f"[main] reconnecting in {backoff:.1f}s...")
+            log("main_disconnect", f"[main] stream error / disconnected: {e}", level="warning")
+            log("main_disconnect", f"[main] reconnecting in {backoff:.1f}s...")
             try:
                 time.sleep(backoff)
             except KeyboardInterrupt:
                 print("Stopping on keyboard interrupt.")
-                try:
-                    if hasattr(engine_inst, "close"):
-                        engine_inst.close()
-                except Exception:
-                    pass
-                sys.exit(0)
+                shutdown(0)
             # exponential backoff up to 60s
             backoff = min(backoff * 2.0, 60.0)
             # recreate client/session to recover from stale connection
             try:
                 create_client()
             except Exception as ce:
-                print(f"[main] failed to recreate client: {ce}")
+                log("main_error", f"[main] failed to recreate client: {ce}", level="error")
                 # continue loop -> will attempt again
                 continue
 
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import datetime
+import io
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import chess
+import chess.engine
+
+try:
+    from config import LOG_DIR, LOG_QUEUE_SIZE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_CONSOLE
+except ImportError:
+    LOG_DIR, LOG_QUEUE_SIZE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_CONSOLE = "logs", 10000, 10 * 1024 * 1024, 5, True
+
+# record kinds in the queue
+_LOG = "log"
+_MOVE = "move"
+_GAME = "game"
+_FLUSH = "flush"
+_STOP = "stop"
+
+_BATCH = 256
+_GAME_PUT_TIMEOUT = 2.0  # วินาทีที่ log_game รอคิว ก่อนเขียน PGN เองโดยตรง
+
+
+class _RotatingFile:
+    """Append-only file that rotates to name.1 .. name.N once it grows past max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int, backups: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._f: Optional[io.TextIOBase] = None
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        if self._f is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+        self._f.write(text)
+        self._f.flush()
+        if self.max_bytes and self._f.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self) -> None:
+        if self._f is not None:
+            try:
+                self._f.close()
+            except Exception:
+                pass
+            self._f = None
+
+
+class AsyncLogger:
+    """
+    Non-blocking log pipeline: callers only enqueue, a single worker thread formats and
+    writes in batches. When the queue is full records are dropped (and counted) instead
+    of blocking the caller.
+    """
+
+    def __init__(self, log_dir: str = LOG_DIR, queue_size: int = LOG_QUEUE_SIZE,
+                 max_bytes: int = LOG_MAX_BYTES, backups: int = LOG_BACKUPS, console: bool = LOG_CONSOLE) -> None:
+        self.log_dir = log_dir
+        self.console = console
+        self.dropped = 0
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._events = _RotatingFile(os.path.join(log_dir, "bot.jsonl"), max_bytes, backups)
+        self._moves = _RotatingFile(os.path.join(log_dir, "moves.jsonl"), max_bytes, backups)
+        self._games = _RotatingFile(os.path.join(log_dir, "games.pgn"), max_bytes, backups)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._games_lock = threading.Lock()  # worker กับ log_game (คิวเต็ม) เขียน games.pgn ไฟล์เดียวกัน
+        self._reported_dropped = 0
+
+    # -------------------------
+    # producer side (hot path)
+    # -------------------------
+    def _put(self, item: tuple) -> bool:
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def log(self, event: str, msg: str = "", level: str = "info", **fields: Any) -> None:
+        fields.update(ts=time.time(), event=event, level=level, msg=msg, thread=threading.current_thread().name)
+        self._put((_LOG, fields))
+
+    def move(self, game_id: str, **fields: Any) -> None:
+        """Per-move telemetry: think time, eval, depth, nps, ..."""
+        fields.update(ts=time.time(), game_id=game_id)
+        self._put((_MOVE, fields))
+
+    def game(self, game_id: str, moves: str, headers: Optional[Dict[str, str]] = None,
+             evals: Optional[Dict[int, int]] = None) -> None:
+        """
+        Queue a finished game for PGN persistence. `evals` maps ply -> cp (white POV).
+        Game records are never dropped: called after the game ended (not during a search),
+        so it may wait for the queue and finally writes the PGN itself.
+        """
+        record = {"game_id": game_id, "moves": moves, "headers": headers or {}, "evals": evals or {}}
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put((_GAME, record), timeout=_GAME_PUT_TIMEOUT)
+            return
+        except queue.Full:
+            pass
+        try:
+            text = _format_pgn(record)
+            with self._games_lock:
+                self._games.write(text)
+        except Exception as e:
+            print(f"[botlog] cannot write PGN for {game_id}: {e}")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is written."""
+        done = threading.Event()
+        if not self._put((_FLUSH, done)):
+            return False
+        return done.wait(timeout)
+
+    # -------------------------
+    # worker
+    # -------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="botlog", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        try:
+            self._queue.put((_STOP, None), timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = self._write_batch(batch)
+
+    def _write_batch(self, batch: List[tuple]) -> bool:
+        events, moves, games, waiters = [], [], [], []
+        running = True
+        for kind, payload in batch:
+            if kind == _LOG:
+                events.append(payload)
+            elif kind == _MOVE:
+                moves.append(json.dumps(payload, ensure_ascii=False, default=str))
+            elif kind == _GAME:
+                try:
+                    games.append(_format_pgn(payload))
+                except Exception as e:
+                    events.append({"ts": time.time(), "event": "pgn_error", "level": "error",
+                                   "msg": f"[botlog] cannot build PGN for {payload.get('game_id')}: {e}"})
+            elif kind == _FLUSH:
+                waiters.append(payload)
+            elif kind == _STOP:
+                running = False
+
+        with self._lock:
+            dropped = self.dropped
+        if dropped != self._reported_dropped:
+            events.append({"ts": time.time(), "event": "log_dropped", "level": "warning",
+                           "msg": f"[botlog] dropped {dropped - self._reported_dropped} records (queue full)",
+                           "dropped_total": dropped})
+            self._reported_dropped = dropped
+
+        try:
+            if self.console:
+                for rec in events:
+                    if rec.get("msg"):
+                        print(rec["msg"])
+            self._events.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in events))
+            self._moves.write("".join(m + "\n" for m in moves))
+            with self._games_lock:
+                self._games.write("".join(games))
+        except Exception as e:
+            print(f"[botlog] write failed: {e}")
+
+        for w in waiters:
+            w.set()
+        if not running:
+            self._events.close()
+            self._moves.close()
+            with self._games_lock:
+                self._games.close()
+        return running
+
+
+def _format_pgn(record: Dict[str, Any]) -> str:
+    import chess.pgn  # ใช้เฉพาะตอนเขียน PGN (worker thread) -> ไม่ต้องโหลดตอน startup
+
+    game = chess.pgn.Game()
+    game.headers["Event"] = "Lichess bot game"
+    game.headers["Site"] = f"https://lichess.org/{record['game_id']}"
+    game.headers["Date"] = datetime.date.today().strftime("%Y.%m.%d")
+    for k, v in record["headers"].items():
+        if v is not None:
+            game.headers[k] = str(v)
+    evals = record["evals"]
+    node = game
+    board = game.board()
+    for ply, uci in enumerate(record["moves"].split()):
+        try:
+            move = chess.Move.from_uci(uci)
+            if not board.is_legal(move):
+                break
+        except Exception:
+            break
+        board.push(move)
+        node = node.add_variation(move)
+        cp = evals.get(ply)
+        if cp is not None:
+            node.set_eval(chess.engine.PovScore(chess.engine.Cp(int(cp)), chess.WHITE))
+    return str(game) + "\n\n"
+
+
+# -------------------------
+# module-level default logger
+# -------------------------
+_default = AsyncLogger()
+
+
+def log(event: str, msg: str = "", level: str = "info", **fields: Any) -> None:
+    _default.log(event, msg, level, **fields)
+
+
+def log_move(game_id: str, **fields: Any) -> None:
+    _default.move(game_id, **fields)
+
+
+def log_game(game_id: str, moves: str, headers: Optional[Dict[str, str]] = None,
+             evals: Optional[Dict[int, int]] = None) -> None:
+    _default.game(game_id, moves, headers, evals)
+
+
+def flush(timeout: float = 5.0) -> bool:
+    return _default.flush(timeout)
+
+
+def stop(timeout: float = 5.0) -> None:
+    _default.stop(timeout)
+
+
+def dropped() -> int:
+    return _default.dropped
@@ -7,9 +7,64 @@ GAME_VARIANT = "unlimited"  # ไม่จำกัดเวลา, casual
 
 # --- Engine & Time Management ---
 STOCKFISH_PATH = "stockfish" # หรือ "stockfish.exe"
+STOCKFISH_CACHE = "stockfish_cache.json"  # ผล probe/benchmark ของแต่ละ binary (key = sha256)
+DISCOVERY_BENCH = True       # benchmark ทุก binary ที่เจอ แล้วเลือกตัวที่เร็วที่สุด
+DISCOVERY_BENCH_DEPTH = 8    # depth ของ `stockfish bench` (ทำครั้งเดียวต่อ binary)
+ENGINE_START_ATTEMPTS = 3    # เปิด engine ไม่สำเร็จกี่ครั้งถึงจะออกจากโปรแกรม
+ENGINE_READY_WAIT = 10       # วินาทีที่ challenge รอ engine warm-up ก่อนจะปฏิเสธ (later)
 MOVE_OVERHEAD = 500  # ms (หักลบเวลาเพื่อกันเวลาหมดเพราะเน็ตช้า)
 MIN_TIME = 0.05      # วินาทีขั้นต่ำต่อตา (ปรับลดลงเพื่อ Ultra Speed)
 MAX_TIME = 20.0      # วินาทีสูงสุดต่อตา (เพิ่มขึ้นเพื่อกรณีเสียเปรียบหนัก)
 DEFAULT_DEPTH = 15   # Depth พื้นฐานถ้าไม่ใช้เวลา
+CONTEXT_HISTORY = 32     # จำนวน eval ย้อนหลังต่อเกมที่เก็บไว้ (ring buffer)
+EVAL_TREND_WINDOW = 6    # ใช้ eval กี่ตาล่าสุดในการดูแนวโน้ม
+EVAL_TREND_DROP = 30     # แนวโน้มแย่ลงเกินกี่ cp/ตา -> คิดนานขึ้น 1.5x
 
+# --- Experience Book (เรียนรู้จากเกมที่เล่นจบแล้ว) ---
+EXPERIENCE_ENABLED = True
+EXPERIENCE_PATH = "experience.bin"
+EXPERIENCE_MAX_ENTRIES = 200000  # จำนวน (ตำแหน่ง, ตาเดิน) สูงสุดในไฟล์
+EXPERIENCE_MAX_PLY = 60          # บันทึกเฉพาะช่วงต้น/กลางเกม (ตำแหน่งหลังจากนี้แทบไม่ซ้ำ)
+EXPERIENCE_MIN_GAMES = 3         # ต้องเคยเล่นตำแหน่งนี้อย่างน้อยกี่เกมถึงจะเชื่อ
+EXPERIENCE_INSTANT_SCORE = 0.75  # ผลงาน >= ค่านี้ -> เดินทันทีไม่ต้องคิด
+EXPERIENCE_TIME_FACTOR = 0.5     # ตำแหน่งที่รู้จักแต่ยังไม่ชัวร์ -> ใช้เวลาคิดน้อยลง
+EXPERIENCE_MIN_EVAL = -50        # eval เฉลี่ย (cp) ของตาเดินต้องไม่ต่ำกว่านี้ (ชนะเพราะโชคไม่นับ)
 
+# --- Instant play (เดินทันทีโดยไม่ต้อง search) ---
+TRIAGE_SINGLE_MOVE = True        # มีตาเดินถูกกฎตาเดียว
+TRIAGE_MATE = True               # เดินต่อตาม mate-in-N ที่หาเจอแล้ว
+TRIAGE_PV = True                 # เดินต่อตาม PV ของ search ก่อนหน้า ถ้าคู่แข่งเดินตามที่คาด
+TRIAGE_PV_MIN_DEPTH = 18         # depth ขั้นต่ำของ search ก่อนหน้าที่ยอมเชื่อ
+TRIAGE_PV_RECAPTURE_ONLY = True  # ใช้ PV shortcut เฉพาะการกินคืนที่ชัดเจน
+
+# --- Logging (เขียน log แบบ background ไม่บล็อก search) ---
+LOG_DIR = "logs"                  # bot.jsonl (events), moves.jsonl (telemetry), games.pgn
+LOG_QUEUE_SIZE = 10000            # คิวเต็ม -> ทิ้ง log แทนการรอ
+LOG_MAX_BYTES = 10 * 1024 * 1024  # ขนาดไฟล์ก่อน rotate
+LOG_BACKUPS = 5                   # จำนวนไฟล์เก่าที่เก็บไว้
+LOG_CONSOLE = True                # พิมพ์ข้อความลง stdout ด้วย (จาก worker thread)
+
+# --- Drain / Shutdown (SIGTERM หรือ Ctrl+C ครั้งแรก = drain, ครั้งที่สอง = หยุดทันที) ---
+DRAIN_TIMEOUT = 600         # วินาทีสูงสุดที่รอให้เกมที่ค้างอยู่จบ
+DRAIN_MAX_MOVE_TIME = 1.0   # เพดานเวลาคิดต่อตาระหว่าง drain (วินาที)
+DRAIN_HANDOFF = False       # True = ปล่อยเกมให้ process ใหม่ (ที่ stream event ด้วย token เดียวกัน) เล่นต่อ
+DRAIN_REPORT_INTERVAL = 10  # รายงานความคืบหน้าทุก ๆ กี่วินาที
+
+# --- Profiling (เปิด/ปิดตอนรันได้: kill -USR1 <pid> = toggle, kill -USR2 <pid> = timers) ---
+PROFILE_DIR = "logs/profiles"   # collapsed stacks (flamegraph.pl / speedscope) + timers JSON
+PROFILE_INTERVAL = 0.005        # วินาทีต่อ sample (200Hz)
+PROFILE_MAX_DEPTH = 64          # ความลึก stack สูงสุดต่อ sample
+PROFILE_CONTROL_PORT = 0        # > 0 = เปิด control socket ที่ 127.0.0.1:<port> (start/stop/toggle/timers)
+
+# --- Adjudication (ยอมแพ้ / เสมอ เมื่อผลเกมชัดแล้ว -> คืนเวลา engine ให้เกมที่ยังชนะได้) ---
+ADJUDICATE_RESIGN = True          # ยอมแพ้เมื่อแพ้ชัดเจน
+ADJUDICATE_RESIGN_SCORE = -1000   # cp (มุมมองเรา) ที่ถือว่าแพ้แน่ (mate = -10000)
+ADJUDICATE_RESIGN_MOVES = 5       # eval ต้องต่ำกว่าเกณฑ์ติดต่อกันกี่ตา
+ADJUDICATE_RESIGN_MIN_MOVES = 20  # ไม่ยอมแพ้ก่อนเราเดินครบกี่ตา
+ADJUDICATE_DRAW = True            # ขอเสมอ / รับเสมอ เมื่อเกมตาย
+ADJUDICATE_DRAW_SCORE = 15        # |eval| (cp) ที่ถือว่าเสมอ
+ADJUDICATE_DRAW_MOVES = 8         # eval ต้องอยู่ในช่วงเสมอติดต่อกันกี่ตา
+ADJUDICATE_DRAW_MIN_MOVES = 40    # ไม่ขอ/รับเสมอก่อนเราเดินครบกี่ตา
+ADJUDICATE_DRAW_OFFER_EVERY = 10  # ขอเสมอซ้ำได้ทุก ๆ กี่ตา
+SYZYGY_PATH = ""                  # โฟลเดอร์ Syzygy tablebase ("" = ไม่ใช้) -> ผลแพ้/เสมอแน่นอน
+SYZYGY_MAX_PIECES = 6             # จำนวนตัวหมากสูงสุดที่มี tablebase
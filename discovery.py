@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import chess.engine
+
+from botlog import log, flush
+
+try:
+    from config import STOCKFISH_CACHE, DISCOVERY_BENCH, DISCOVERY_BENCH_DEPTH
+except ImportError:
+    STOCKFISH_CACHE, DISCOVERY_BENCH, DISCOVERY_BENCH_DEPTH = "stockfish_cache.json", True, 8
+
+_CANDIDATE_NAMES = ["stockfish", "stockfish.exe", "stockfish_15", "stockfish-windows-x86-64-avx2.exe"]
+_CPU_FLAGS = ("AVX512", "VNNI", "AVX2", "BMI2", "SSE41", "SSSE3", "POPCNT", "NEON")
+_CACHE_VERSION = 1
+
+
+class EngineCapabilities:
+    """UCI option schema + build info of one Stockfish binary (as probed and cached on disk)."""
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.path: str = data.get("path", "")
+        self.sha256: str = data.get("sha256", "")
+        self.name: str = data.get("name", "")
+        self.options: Dict[str, Dict[str, Any]] = data.get("options", {})
+        self.cpu_flags: List[str] = data.get("cpu_flags", [])
+        self.nps: int = data.get("nps", 0)
+
+    @property
+    def nnue(self) -> bool:
+        return "EvalFile" in self.options or "Use NNUE" in self.options
+
+    def supports(self, option: str) -> bool:
+        return option in self.options
+
+    def clamp(self, option: str, value: int) -> Optional[int]:
+        """Clamp `value` into the option's min..max; None if the option does not exist."""
+        spec = self.options.get(option)
+        if spec is None:
+            return None
+        lo, hi = spec.get("min"), spec.get("max")
+        if lo is not None:
+            value = max(int(lo), value)
+        if hi is not None:
+            value = min(int(hi), value)
+        return value
+
+    def filter(self, options: Dict[str, Any]) -> Dict[str, Any]:
+        """Drop unsupported options and clamp numeric ones, ready for configure()."""
+        out = {}
+        for name, value in options.items():
+            if not self.supports(name):
+                continue
+            out[name] = self.clamp(name, value) if isinstance(value, int) and not isinstance(value, bool) else value
+        return out
+
+    def summary(self) -> str:
+        flags = "/".join(self.cpu_flags) or "?"
+        threads = self.options.get("Threads", {}).get("max")
+        hash_mb = self.options.get("Hash", {}).get("max")
+        return (f"{self.name or '?'} [{flags}] nnue={self.nnue} nps={self.nps} "
+                f"max Threads={threads} Hash={hash_mb} skill={self.supports('Skill Level')}")
+
+
+# -------------------------
+# candidate discovery
+# -------------------------
+def find_candidates(configured_path: Optional[str]) -> List[str]:
+    """All Stockfish binaries we can see: configured path, known names / stockfish* here, PATH."""
+    found: List[str] = []
+
+    def add(p: Optional[str]) -> None:
+        if p and os.path.isfile(p):
+            p = os.path.abspath(p)
+            if p not in found:
+                found.append(p)
+
+    add(configured_path)
+    if configured_path and not os.path.isfile(configured_path):
+        add(shutil.which(configured_path))
+    for name in _CANDIDATE_NAMES:
+        add(name)
+    for name in sorted(glob.glob("stockfish*")):
+        if not name.endswith((".json", ".tmp", ".txt", ".md", ".nnue", ".zip", ".tar")):
+            add(name)
+    add(shutil.which("stockfish"))
+    return found
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# -------------------------
+# probing
+# -------------------------
+def _option_schema(option: chess.engine.Option) -> Dict[str, Any]:
+    return {"type": option.type, "default": option.default, "min": option.min, "max": option.max,
+            "var": list(option.var) if option.var else None}
+
+
+def _compiler_flags(path: str) -> List[str]:
+    """Ask the binary for its compile settings (Stockfish `compiler` command)."""
+    try:
+        out = subprocess.run([path], input="compiler\nquit\n", capture_output=True, text=True, timeout=10)
+        text = out.stdout + out.stderr
+    except Exception:
+        return []
+    return [flag for flag in _CPU_FLAGS if re.search(rf"\b{flag}\b", text, re.IGNORECASE)]
+
+
+def _bench(path: str, depth: int) -> int:
+    """Nodes/second over Stockfish's built-in fixed bench (16MB hash, 1 thread). 0 if unavailable."""
+    try:
+        out = subprocess.run([path, "bench", "16", "1", str(depth)], capture_output=True, text=True,
+                             timeout=120, stdin=subprocess.DEVNULL)
+        m = re.search(r"Nodes/second\s*:\s*(\d+)", out.stdout + out.stderr)
+        return int(m.group(1)) if m else 0
+    except Exception:
+        return 0
+
+
+def probe(path: str, sha256: str, bench: bool = True, bench_depth: int = 8) -> Dict[str, Any]:
+    """Start the binary once to read its UCI id/options, then benchmark it."""
+    engine = chess.engine.SimpleEngine.popen_uci(path)
+    try:
+        name = engine.id.get("name", "")
+        options = {opt.name: _option_schema(opt) for opt in engine.options.values()}
+    finally:
+        try:
+            engine.quit()
+        except Exception:
+            pass
+    return {
+        "path": path,
+        "sha256": sha256,
+        "name": name,
+        "options": options,
+        "cpu_flags": _compiler_flags(path),
+        "nps": _bench(path, bench_depth) if bench else 0,
+        "probed_at": time.time(),
+    }
+
+
+# -------------------------
+# cache
+# -------------------------
+def _load_cache(cache_path: str) -> Dict[str, Any]:
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == _CACHE_VERSION:
+            return cache
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log("discovery", f"[discovery] ignoring unreadable cache {cache_path}: {e}", level="warning")
+    return {"version": _CACHE_VERSION, "files": {}, "binaries": {}}
+
+
+def _save_cache(cache_path: str, cache: Dict[str, Any]) -> None:
+    tmp = f"{cache_path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, cache_path)
+    except Exception as e:
+        log("discovery", f"[discovery] failed to save cache {cache_path}: {e}", level="warning")
+
+
+def _stamp(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, int(st.st_mtime)]
+
+
+def _file_hash(path: str, cache: Dict[str, Any]) -> str:
+    """sha256 of the binary; re-hashed only when its size/mtime changed."""
+    stamp = _stamp(path)
+    known = cache["files"].get(path)
+    if known and known.get("stamp") == stamp:
+        return known["sha256"]
+    sha = _sha256(path)
+    cache["files"][path] = {"stamp": stamp, "sha256": sha}
+    return sha
+
+
+def cached_choice(configured_path: Optional[str], cache_path: str = STOCKFISH_CACHE) -> Tuple[str, Optional[EngineCapabilities]]:
+    """
+    Pick a binary without probing anything: the fastest candidate already in the cache
+    (matched by size/mtime, no re-hash), else the first candidate found. Run discover()
+    afterwards to probe new binaries; its winner is picked up here on the next start.
+    """
+    cache = _load_cache(cache_path)
+    candidates = find_candidates(configured_path)
+    best: Optional[EngineCapabilities] = None
+    for path in candidates:
+        try:
+            known = cache["files"].get(path)
+            if not known or known.get("stamp") != _stamp(path):
+                continue
+            data = cache["binaries"].get(known["sha256"])
+        except OSError:
+            continue
+        if data is None:
+            continue
+        caps = EngineCapabilities(dict(data, path=path))
+        if best is None or caps.nps > best.nps:
+            best = caps
+    if best is not None:
+        return best.path, best
+    if candidates:
+        return candidates[0], None
+    return configured_path, None
+
+
+def discover(configured_path: Optional[str], cache_path: str = STOCKFISH_CACHE,
+             bench: bool = DISCOVERY_BENCH, bench_depth: int = DISCOVERY_BENCH_DEPTH) -> Tuple[str, Optional[EngineCapabilities]]:
+    """
+    Find every Stockfish binary, probe + benchmark the ones not yet in the cache and
+    return (path, capabilities) of the fastest. Falls back to (configured_path, None).
+    """
+    cache = _load_cache(cache_path)
+    dirty = False
+    best: Optional[EngineCapabilities] = None
+    for path in find_candidates(configured_path):
+        try:
+            before = dict(cache["files"].get(path) or {})
+            sha = _file_hash(path, cache)
+            dirty |= cache["files"].get(path) != before
+            data = cache["binaries"].get(sha)
+            if data is None:
+                log("discovery", f"[discovery] probing {path} ...")
+                data = probe(path, sha, bench=bench, bench_depth=bench_depth)
+                cache["binaries"][sha] = data
+                dirty = True
+            data = dict(data, path=path)
+        except Exception as e:
+            log("discovery", f"[discovery] skipping {path}: {e}", level="warning")
+            continue
+        caps = EngineCapabilities(data)
+        if best is None or caps.nps > best.nps:
+            best = caps
+    if dirty:
+        _save_cache(cache_path, cache)
+    if best is None:
+        return configured_path, None
+    return best.path, best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stockfish discovery / capability cache")
+    parser.add_argument("path", nargs="?", default=None)
+    parser.add_argument("--refresh", action="store_true", help="drop the cache and probe again")
+    args = parser.parse_args()
+    try:
+        from config import STOCKFISH_PATH
+    except ImportError:
+        STOCKFISH_PATH = "stockfish"
+    if args.refresh and os.path.exists(STOCKFISH_CACHE):
+        os.remove(STOCKFISH_CACHE)
+    sf_path, sf_caps = discover(args.path or STOCKFISH_PATH)
+    print(f"selected: {sf_path}")
+    if sf_caps is not None:
+        print(sf_caps.summary())
+    flush()
@@ -1,13 +1,20 @@
 from __future__ import annotations
 
 import os
+import shutil
+import threading
 import time
+from array import array
 from typing import Optional, Any
 
 import chess
 import chess.engine
+import chess.polyglot
 from chess.engine import EngineTerminatedError, EngineError
 
+from botlog import log
+from profiler import timed
+
 
 def _read_skill_env() -> Optional[int]:
     for key in ("STOCKFISH_SKILL", "BOT_SKILL_LEVEL", "START_BOT_SKILL"):
@@ -16,7 +23,7 @@ def _read_skill_env() -> Optional[int]:
             try:
                 return int(v)
             except Exception:
-                print(f"[engine] env {key} exists but is not an integer: {v!r}; ignoring.")
+                log("skill_env", f"[engine] env {key} exists but is not an integer: {v!r}; ignoring.", level="warning")
     return None
 
 
@@ -33,6 +40,92 @@ def _clamp_skill_for_stockfish(skill: int) -> int:
     return s
 
 
+_EVAL_CLAMP = 10000
+
+
+class _Ring:
+    """Fixed-size ring buffer backed by a typed array (compact, no per-item objects)."""
+
+    __slots__ = ("_buf", "_size", "_pos", "_count")
+
+    def __init__(self, size: int, typecode: str = "h") -> None:
+        self._size = max(1, int(size))
+        self._buf = array(typecode, [0] * self._size)
+        self._pos = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, value: float) -> None:
+        self._buf[self._pos] = value
+        self._pos = (self._pos + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def values(self, last: Optional[int] = None) -> list:
+        """Oldest -> newest (optionally only the newest `last` values)."""
+        n = self._count if last is None else min(last, self._count)
+        start = (self._pos - n) % self._size
+        return [self._buf[(start + i) % self._size] for i in range(n)]
+
+
+class SearchContext:
+    """
+    Per-game search state: eval history, previous search (PV / mate), time used,
+    ponder move and which engine serves the game. One instance per game handler.
+    """
+
+    def __init__(self, game_id: Optional[str] = None, color: Optional[str] = None,
+                 engine: Optional["Engine"] = None, history: int = 32) -> None:
+        self.game_id = game_id
+        self.color = color
+        self.engine = engine  # engine affinity
+        self.evals = _Ring(history, "h")  # cp (มุมมองเรา) หลังแต่ละตาที่เราเดิน
+        self.think_times = _Ring(history, "f")
+        self.time_used = 0.0
+        self.moves_played = 0
+        self.last: Optional[dict] = None  # search_info ของตาก่อนหน้า (PV / mate / depth)
+        self.pending: Optional[dict] = None
+        self.ponder_move: Optional[chess.Move] = None
+        self.draw_offered_at: Optional[int] = None  # moves_played ตอนที่เราขอเสมอครั้งล่าสุด
+
+    def begin(self) -> dict:
+        """Start a new move decision; the engine fills the returned dict."""
+        self.pending = {}
+        return self.pending
+
+    def commit(self) -> Optional[dict]:
+        """The pending move was actually played: move it into the history."""
+        info, self.pending = self.pending, None
+        if info is None:
+            return None
+        score = info.get("score")
+        if score is not None:
+            self.evals.push(max(-_EVAL_CLAMP, min(_EVAL_CLAMP, int(score))))
+        think_time = info.get("think_time")
+        if think_time is not None:
+            self.think_times.push(think_time)
+            self.time_used += think_time
+        self.ponder_move = info.get("ponder")
+        self.moves_played += 1
+        self.last = info
+        return info
+
+    def eval_trend(self, current: Optional[int] = None, window: int = 6) -> Optional[float]:
+        """Least-squares slope (cp per move) of the recent evals, including `current`."""
+        ys = self.evals.values(window)
+        if current is not None:
+            ys.append(max(-_EVAL_CLAMP, min(_EVAL_CLAMP, int(current))))
+        n = len(ys)
+        if n < 2:
+            return None
+        mean_x = (n - 1) / 2.0
+        mean_y = sum(ys) / n
+        num = sum((i - mean_x) * (y - mean_y) for i, y in enumerate(ys))
+        den = sum((i - mean_x) ** 2 for i in range(n))
+        return num / den
+
+
 class Engine:
     def __init__(
         self,
@@ -42,6 +135,9 @@ class Engine:
         hash_mb: int = 64,
         default_time: Optional[float] = None,
         default_depth: Optional[int] = 15,
+        experience: Optional[Any] = None,
+        lazy: bool = False,
+        capabilities: Optional[Any] = None,
     ) -> None:
         # determine effective skill: priority -> arg > env > default(3)
         env_skill = _read_skill_env()
@@ -64,41 +160,77 @@ class Engine:
         self.hash_mb = max(1, int(hash_mb))
         self.default_time = default_time
         self.default_depth = default_depth or 15
+        self.experience = experience  # ExperienceBook (optional)
+        self.capabilities = capabilities  # EngineCapabilities จาก discovery (optional)
+        self.metrics: dict = {}  # counters: search / triage_* / experience_move
+        self._metrics_lock = threading.Lock()
+        self.startup_timings: dict = {}  # ms: spawn / configure / isready
+        self.max_move_time: Optional[float] = None  # เพดานเวลาคิดต่อตา (วินาที) เช่นตอน drain
 
         self._engine: Optional[chess.engine.SimpleEngine] = None
-        self._last_eval: Optional[chess.engine.Score] = None
-        self._start_engine()
+        # lazy=True: ยังไม่ spawn process จนกว่าจะเรียก warm_up() หรือ search ครั้งแรก
+        if not lazy:
+            self._start_engine()
 
     def _start_engine(self) -> None:
         if self._engine:
             return
+        t0 = time.monotonic()
         try:
-            # Try to find stockfish in path if not specified correctly
-            import shutil
-            actual_path = shutil.which(self.path) or self.path
+            # path ที่ค้นหามาแล้ว (check_stockfish) ใช้ได้เลย ไม่ต้อง which ซ้ำ
+            actual_path = self.path if os.path.isfile(self.path) else (shutil.which(self.path) or self.path)
             self._engine = chess.engine.SimpleEngine.popen_uci(actual_path)
         except Exception as e:
             raise RuntimeError(f"Cannot start Stockfish at '{self.path}': {e}") from e
+        t1 = time.monotonic()
 
         try:
-            self._engine.configure({
+            # MultiPV ถูกจัดการโดย python-chess เอง (analyse(multipv=...)) จึงไม่ต้อง configure
+            self._engine.configure(self._validated({
                 "Skill Level": int(self.skill_level),
                 "Threads": int(self.threads),
                 "Hash": int(self.hash_mb),
-                "MultiPV": 3 # For complexity analysis
-            })
+            }))
+        except Exception as e:
+            log("engine_config", f"[engine] Configuration error: {e}", level="warning")
+        self.startup_timings.update(
+            spawn_ms=round((t1 - t0) * 1000, 1),
+            configure_ms=round((time.monotonic() - t1) * 1000, 1),
+        )
+
+    def warm_up(self) -> dict:
+        """
+        Spawn and configure the engine, then do one isready round so the NNUE net and
+        hash are loaded before the first real search. Returns startup timings (ms).
+        """
+        self._start_engine()
+        t0 = time.monotonic()
+        try:
+            self._engine.ping()
         except Exception as e:
-            print(f"[engine] Configuration error: {e}")
+            log("engine_warmup", f"[engine] isready failed: {e}", level="warning")
+        self.startup_timings["isready_ms"] = round((time.monotonic() - t0) * 1000, 1)
+        return dict(self.startup_timings)
 
-    def calculate_time(self, board: chess.Board, wtime: float, btime: float, winc: float = 0, binc: float = 0) -> float:
+    @timed("Engine.calculate_time")
+    def calculate_time(self, board: chess.Board, wtime: float, btime: float, winc: float = 0, binc: float = 0,
+                       ctx: Optional[SearchContext] = None) -> float:
         """
         Calculate thinking time based on remaining clock and game complexity.
-        Times are in milliseconds.
+        Times are in milliseconds. `ctx` supplies the eval history of this game.
         """
         try:
             from config import MOVE_OVERHEAD, MIN_TIME, MAX_TIME
         except ImportError:
             MOVE_OVERHEAD, MIN_TIME, MAX_TIME = 500, 0.1, 10.0
+        try:
+            from config import EVAL_TREND_WINDOW, EVAL_TREND_DROP
+        except ImportError:
+            EVAL_TREND_WINDOW, EVAL_TREND_DROP = 6, 30
+        try:
+            from config import ADJUDICATE_RESIGN, ADJUDICATE_RESIGN_SCORE
+        except ImportError:
+            ADJUDICATE_RESIGN, ADJUDICATE_RESIGN_SCORE = False, -1000
 
         my_time = wtime if board.turn == chess.WHITE else btime
         my_inc = winc if board.turn == chess.WHITE else binc
@@ -110,7 +242,7 @@ class Engine:
         if my_time < (1500 + MOVE_OVERHEAD):
             # Still try to give it a tiny bit of time if possible, but prioritize speed.
             panic_time = max(0.05, (my_time - MOVE_OVERHEAD) / 1000.0 / 2)
-            print(f"[engine] Panic Mode! Time: {my_time}ms. Moving at {panic_time:.3f}s")
+            log("panic_mode", f"[engine] Panic Mode! Time: {my_time}ms. Moving at {panic_time:.3f}s", my_time=my_time, think=panic_time)
             return panic_time
 
         # Base time: roughly 1/30th to 1/10th of remaining time
@@ -141,23 +273,26 @@ class Engine:
                     
                     # 3. Losing position logic (User request)
                     # If losing, think much longer to find a way out.
-                    if score < -500: # Down by a rook or more
-                        print(f"[engine] Critical disadvantage ({score}). Thinking 4x longer.")
+                    if ADJUDICATE_RESIGN and score <= ADJUDICATE_RESIGN_SCORE:
+                        # แพ้ชัดเจน (กำลังจะยอมแพ้) -> ไม่เผาเวลาเพิ่ม คืน engine ให้เกมอื่น
+                        log("time_extend", f"[engine] Hopeless position ({score}). Not extending.", score=score, factor=1.0)
+                    elif score < -500: # Down by a rook or more
+                        log("time_extend", f"[engine] Critical disadvantage ({score}). Thinking 4x longer.", score=score, factor=4.0)
                         multiplier *= 4.0
                     elif score < -150: # Down by 1.5 pawns
-                        print(f"[engine] Significant disadvantage ({score}). Thinking 2.5x longer.")
+                        log("time_extend", f"[engine] Significant disadvantage ({score}). Thinking 2.5x longer.", score=score, factor=2.5)
                         multiplier *= 2.5
                     
-                    # 4. Critical Score Change
-                    if self._last_eval is not None:
+                    # 4. Critical Score Change (eval history ของเกมนี้เท่านั้น)
+                    if ctx is not None and len(ctx.evals):
                         try:
-                            last_score = self._last_eval.score() if not self._last_eval.is_mate() else (-10000 if self._last_eval.mate() < 0 else 10000)
-                            diff = score - last_score
-                            if diff < -100: # Position getting worse
+                            last_score = ctx.evals.values(1)[0]
+                            trend = ctx.eval_trend(score, EVAL_TREND_WINDOW)
+                            # แย่ลงฉับพลัน หรือค่อย ๆ แย่ลงต่อเนื่องหลายตา
+                            if score - last_score < -100 or (trend is not None and trend < -EVAL_TREND_DROP):
                                 multiplier *= 1.5
-                        except: pass
-                    
-                    self._last_eval = current_eval
+                        except Exception:
+                            pass
                     
                     # 5. Competition between moves
                     if len(info) >= 2:
@@ -177,6 +312,101 @@ class Engine:
         
         return max(MIN_TIME, min(final_time, MAX_TIME, max_allowed))
 
+    # -------------------------
+    # pre-search triage
+    # -------------------------
+    def _count(self, name: str) -> None:
+        with self._metrics_lock:
+            self.metrics[name] = self.metrics.get(name, 0) + 1
+
+    def get_metrics(self) -> dict:
+        with self._metrics_lock:
+            return dict(self.metrics)
+
+    @staticmethod
+    def _fill_search_info(
+        search_info: Optional[dict],
+        board: chess.Board,
+        move: chess.Move,
+        source: str,
+        score: Optional[int] = None,
+        mate: Optional[int] = None,
+        depth: Optional[int] = None,
+        pv: Optional[list] = None,
+    ) -> None:
+        """
+        Store the result of a move decision. When the PV is long enough we also keep the
+        position we expect after our move + the predicted reply, so the next move can
+        be answered without a search if the opponent follows it.
+        """
+        if search_info is None:
+            return
+        search_info.update(score=score, mate=mate, depth=depth, source=source,
+                           expect_key=None, expect_move=None, expect_capture_square=None)
+        if not pv or len(pv) < 3 or pv[0] != move:
+            return
+        try:
+            after = board.copy(stack=False)
+            after.push(pv[0])
+            reply = pv[1]
+            capture_square = reply.to_square if after.is_capture(reply) else None
+            after.push(reply)
+            if not after.is_legal(pv[2]):
+                return
+            search_info.update(
+                expect_key=chess.polyglot.zobrist_hash(after),
+                expect_move=pv[2],
+                expect_capture_square=capture_square,
+                expect_pv=pv[2:],
+            )
+        except Exception:
+            pass
+
+    def _triage(self, board: chess.Board, prev_search: Optional[dict], search_info: Optional[dict]) -> Optional[chess.Move]:
+        """Return a move that can be played without searching, or None."""
+        try:
+            from config import TRIAGE_SINGLE_MOVE, TRIAGE_MATE, TRIAGE_PV, TRIAGE_PV_MIN_DEPTH, TRIAGE_PV_RECAPTURE_ONLY
+        except ImportError:
+            TRIAGE_SINGLE_MOVE, TRIAGE_MATE, TRIAGE_PV, TRIAGE_PV_MIN_DEPTH, TRIAGE_PV_RECAPTURE_ONLY = True, True, True, 18, True
+
+        # 1. Forced move: มีตาเดินเดียว ไม่ต้องคิด
+        if TRIAGE_SINGLE_MOVE:
+            legal = list(board.legal_moves)
+            if len(legal) == 1:
+                self._count("triage_single_move")
+                self._fill_search_info(search_info, board, legal[0], "single_move")
+                return legal[0]
+
+        if not prev_search or prev_search.get("expect_key") is None:
+            return None
+        if prev_search["expect_key"] != chess.polyglot.zobrist_hash(board):
+            return None  # คู่แข่งไม่ได้เดินตาม PV ที่คาดไว้
+        move = prev_search.get("expect_move")
+        if move is None or not board.is_legal(move):
+            return None
+        pv = prev_search.get("expect_pv") or [move]
+
+        # 2. Mate-in-N ที่หาเจอแล้วจาก search ก่อนหน้า -> เดินต่อตาม PV
+        mate = prev_search.get("mate")
+        if TRIAGE_MATE and mate is not None and mate > 1:
+            self._count("triage_mate")
+            self._fill_search_info(search_info, board, move, "mate_pv", score=prev_search.get("score"),
+                                   mate=mate - 1, depth=prev_search.get("depth"), pv=pv)
+            return move
+
+        # 3. PV continuation ที่ search ก่อนหน้ายืนยันไว้ลึกพอ (ค่าเริ่มต้น: recapture เท่านั้น)
+        depth = prev_search.get("depth") or 0
+        if TRIAGE_PV and depth >= TRIAGE_PV_MIN_DEPTH:
+            capture_square = prev_search.get("expect_capture_square")
+            if TRIAGE_PV_RECAPTURE_ONLY and (capture_square is None or move.to_square != capture_square):
+                return None
+            self._count("triage_pv")
+            # PV ที่เหลือสั้นลง 2 ply -> ความลึกที่ยืนยันไว้ก็ลดลงด้วย
+            self._fill_search_info(search_info, board, move, "pv", score=prev_search.get("score"),
+                                   depth=depth - 2, pv=pv)
+            return move
+        return None
+
     def _choose_move_from_board(
         self,
         board: chess.Board,
@@ -187,9 +417,46 @@ class Engine:
         btime: Optional[float] = None,
         winc: Optional[float] = None,
         binc: Optional[float] = None,
+        search_info: Optional[dict] = None,
+        ctx: Optional[SearchContext] = None,
     ) -> Optional[str]:
+        """
+        Pick a move for `board`. If `search_info` is given it is filled with
+        score (cp, side to move), depth, source and the expected continuation of the
+        chosen move. `ctx` is the per-game context (previous search, eval history);
+        when given and `search_info` is None, ctx.begin() provides it.
+        """
         if board.is_game_over():
             return None
+        if ctx is not None and search_info is None:
+            search_info = ctx.begin()
+
+        # Triage: forced move / mate / confirmed PV -> ไม่ต้อง search
+        triaged = self._triage(board, ctx.last if ctx is not None else None, search_info)
+        if triaged is not None:
+            return triaged.uci()
+
+        # Experience book: เคยเล่นตำแหน่งนี้แล้วได้ผลดี -> เดินทันที
+        time_factor = 1.0
+        if self.experience is not None:
+            try:
+                from config import EXPERIENCE_MIN_GAMES, EXPERIENCE_INSTANT_SCORE, EXPERIENCE_TIME_FACTOR
+                from config import EXPERIENCE_MIN_EVAL
+            except ImportError:
+                EXPERIENCE_MIN_GAMES, EXPERIENCE_INSTANT_SCORE, EXPERIENCE_TIME_FACTOR = 3, 0.75, 0.5
+                EXPERIENCE_MIN_EVAL = -50
+            try:
+                book_move, time_factor = self.experience.probe(
+                    board, EXPERIENCE_MIN_GAMES, EXPERIENCE_INSTANT_SCORE, EXPERIENCE_TIME_FACTOR,
+                    EXPERIENCE_MIN_EVAL
+                )
+            except Exception as e:
+                log("experience_error", f"[engine] experience probe failed: {e}", level="warning")
+                book_move, time_factor = None, 1.0
+            if book_move is not None:
+                self._count("experience_move")
+                self._fill_search_info(search_info, board, book_move, "experience")
+                return book_move.uci()
 
         # Start engine FIRST so calculate_time can use it
         if self._engine is None:
@@ -197,20 +464,40 @@ class Engine:
 
         if wtime is not None and btime is not None:
             # Dynamic time management
-            calc_time = self.calculate_time(board, wtime, btime, winc or 0, binc or 0)
+            calc_time = self.calculate_time(board, wtime, btime, winc or 0, binc or 0, ctx=ctx)
+            if time_factor < 1.0:
+                try:
+                    from config import MIN_TIME
+                except ImportError:
+                    MIN_TIME = 0.1
+                calc_time = max(MIN_TIME, calc_time * time_factor)
             limit = chess.engine.Limit(time=calc_time)
         elif time_limit is not None:
             limit = chess.engine.Limit(time=time_limit)
         else:
             limit = chess.engine.Limit(depth=depth or self.default_depth)
 
+        if self.max_move_time is not None:
+            limit.time = min(limit.time, self.max_move_time) if limit.time is not None else self.max_move_time
+
         try:
-            result = self._engine.play(board, limit)
+            result = self._engine.play(board, limit, info=chess.engine.INFO_BASIC | chess.engine.INFO_SCORE | chess.engine.INFO_PV)
             if result is None or result.move is None:
                 return None
+            self._count("search")
+            score = result.info.get("score")
+            self._fill_search_info(
+                search_info, board, result.move, "search",
+                score=score.relative.score(mate_score=10000) if score is not None else None,
+                mate=score.relative.mate() if score is not None else None,
+                depth=result.info.get("depth"),
+                pv=result.info.get("pv"),
+            )
+            if search_info is not None:
+                search_info.update(nodes=result.info.get("nodes"), nps=result.info.get("nps"), ponder=result.ponder)
             return result.move.uci()
         except Exception as e:
-            print(f"[engine] play error: {e}")
+            log("play_error", f"[engine] play error: {e}", level="error", fen=board.fen())
             self._engine = None # Force restart next time
             return None
 
@@ -250,51 +537,68 @@ class Engine:
     # -------------------------
     # runtime config
     # -------------------------
+    def _validated(self, options: dict) -> dict:
+        """Drop/clamp options against the cached capabilities (no-op without them)."""
+        if self.capabilities is None:
+            return options
+        valid = self.capabilities.filter(options)
+        for name, value in options.items():
+            if name not in valid:
+                log("engine_config", f"[engine] option {name!r} not supported by this build; ignored.", level="warning")
+            elif valid[name] != value:
+                log("engine_config", f"[engine] {name}={value} out of range; using {valid[name]}.", level="warning")
+        return valid
+
+    def _apply_option(self, name: str, value: int) -> Optional[int]:
+        """Validate one option and send it to the running engine. Returns the applied value."""
+        options = self._validated({name: value})
+        if name not in options:
+            return None
+        if self._engine:
+            try:
+                self._engine.configure(options)
+            except Exception as e:
+                log("engine_config", f"[engine] failed to set {name}: {e}", level="warning")
+                return None
+        return options[name]
+
     def set_skill_level(self, level: int) -> None:
         """Set skill at runtime. This will clamp to 0..20 for engine configure."""
         try:
             lvl = int(level)
         except Exception:
-            print(f"[engine] set_skill_level: invalid value {level!r}")
+            log("engine_config", f"[engine] set_skill_level: invalid value {level!r}", level="warning")
             return
         if lvl > 20:
             self.custom_skill = lvl
-            print(f"[engine] requested skill {lvl} > 20; clamping to 20 for Stockfish.")
+            log("engine_config", f"[engine] requested skill {lvl} > 20; clamping to 20 for Stockfish.")
         else:
             self.custom_skill = None
         self.skill_level = _clamp_skill_for_stockfish(lvl)
-        if self._engine:
-            try:
-                self._engine.configure({"Skill Level": int(self.skill_level)})
-                print(f"[engine] Skill Level updated to {self.skill_level}")
-            except Exception:
-                print("[engine] Skill Level option not supported by this engine build; ignored.")
+        if self._apply_option("Skill Level", int(self.skill_level)) is not None and self._engine:
+            log("engine_config", f"[engine] Skill Level updated to {self.skill_level}")
 
     def apply_env_skill(self) -> None:
         """Read environment variable again and apply as new skill (if present)."""
         env = _read_skill_env()
         if env is None:
-            print("[engine] apply_env_skill: no env skill found")
+            log("engine_config", "[engine] apply_env_skill: no env skill found")
             return
         self.set_skill_level(env)
 
     def set_threads(self, threads: int) -> None:
-        self.threads = max(1, int(threads))
-        if self._engine:
-            try:
-                self._engine.configure({"Threads": self.threads})
-                print(f"[engine] Threads updated to {self.threads}")
-            except Exception:
-                pass
+        threads = max(1, int(threads))
+        applied = self._apply_option("Threads", threads)
+        self.threads = applied if applied is not None else threads
+        if applied is not None and self._engine:
+            log("engine_config", f"[engine] Threads updated to {self.threads}")
 
     def set_hash(self, mb: int) -> None:
-        self.hash_mb = max(1, int(mb))
-        if self._engine:
-            try:
-                self._engine.configure({"Hash": self.hash_mb})
-                print(f"[engine] Hash updated to {self.hash_mb}MB")
-            except Exception:
-                pass
+        mb = max(1, int(mb))
+        applied = self._apply_option("Hash", mb)
+        self.hash_mb = applied if applied is not None else mb
+        if applied is not None and self._engine:
+            log("engine_config", f"[engine] Hash updated to {self.hash_mb}MB")
 
     # -------------------------
     # cleanup
@@ -318,11 +622,13 @@ if __name__ == "__main__":
     # Or pass skill_level directly below.
     e = Engine(path="stockfish.exe", skill_level=None, threads=2, hash_mb=32, default_time=None, default_depth=6)
     print("[test] Effective skill:", e.skill_level, "custom_skill:", e.custom_skill)
+    board = chess.Board()
     t0 = time.time()
-    mv = e.get_best_move(chess.STARTING_FEN, time_limit=0.05)
+    mv = e._choose_move_from_board(board, time_limit=0.05)
     print("time-based move:", mv, "took:", time.time() - t0)
     t0 = time.time()
-    mv2 = e.get_best_move(chess.STARTING_FEN, depth=6)
+    mv2 = e._choose_move_from_board(board, depth=6)
     print("depth-based move:", mv2, "took:", time.time() - t0)
+    print("metrics:", e.get_metrics())
     e.close()
-
+    # throughput / time-accuracy numbers: python bench.py
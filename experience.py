@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import chess
+import chess.polyglot
+
+
+# -------------------------
+# on-disk format
+# -------------------------
+# header : magic, version, generation (จำนวนเกมที่บันทึกไปแล้ว), record count
+# record : zobrist key, packed move, games, wins, draws, losses, eval sum (cp), last generation
+_MAGIC = b"CBXP"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHII")
+_RECORD = struct.Struct("<QHHHHHiI")
+
+_EVAL_CLAMP = 10000
+_COUNT_MAX = 0xFFFF
+
+
+def _pack_move(move: chess.Move) -> int:
+    promo = move.promotion or 0
+    return move.from_square | (move.to_square << 6) | (promo << 12)
+
+
+def _unpack_move(value: int) -> chess.Move:
+    promo = (value >> 12) & 0x7
+    return chess.Move(value & 0x3F, (value >> 6) & 0x3F, promotion=promo or None)
+
+
+def _result_for(winner: Optional[str], color: chess.Color) -> Optional[float]:
+    """Map a Lichess-style winner ('white'/'black'/None) to 1/0.5/0 for `color`."""
+    if winner is None:
+        return 0.5
+    if winner not in ("white", "black"):
+        return None
+    return 1.0 if (winner == "white") == (color == chess.WHITE) else 0.0
+
+
+class ExperienceEntry:
+    __slots__ = ("games", "wins", "draws", "losses", "eval_sum", "stamp")
+
+    def __init__(self, games: int = 0, wins: int = 0, draws: int = 0, losses: int = 0,
+                 eval_sum: int = 0, stamp: int = 0) -> None:
+        self.games = games
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.eval_sum = eval_sum
+        self.stamp = stamp
+
+    @property
+    def score(self) -> float:
+        """Game score for the side that played the move (0..1)."""
+        if not self.games:
+            return 0.0
+        return (self.wins + 0.5 * self.draws) / self.games
+
+    @property
+    def avg_eval(self) -> float:
+        return self.eval_sum / self.games if self.games else 0.0
+
+    def add(self, result: float, eval_cp: Optional[int], stamp: int) -> None:
+        if self.games >= _COUNT_MAX:
+            # ลดน้ำหนักข้อมูลเก่าลงครึ่งหนึ่งแทนการ overflow
+            self.games //= 2
+            self.wins //= 2
+            self.draws //= 2
+            self.losses //= 2
+            self.eval_sum //= 2
+        self.games += 1
+        if result >= 1.0:
+            self.wins += 1
+        elif result <= 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        if eval_cp is not None:
+            cp = max(-_EVAL_CLAMP, min(_EVAL_CLAMP, int(eval_cp)))
+            self.eval_sum = max(-(2 ** 31), min(2 ** 31 - 1, self.eval_sum + cp))
+        self.stamp = stamp
+
+
+class ExperienceBook:
+    """
+    Experience store learned from our own finished games.
+    Positions are keyed by Zobrist hash; each key maps to the moves we played there
+    with their results and average search eval.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 200000) -> None:
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.generation = 0
+        self._entries: Dict[int, Dict[int, ExperienceEntry]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.RLock()  # one writer at a time (shares the .tmp file)
+        self._save_pending = False
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return self._size
+
+    # -------------------------
+    # lookup
+    # -------------------------
+    def lookup(self, board: chess.Board) -> List[Tuple[chess.Move, ExperienceEntry]]:
+        """Return legal moves we have experience with, best score first."""
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            moves = self._entries.get(key)
+            if not moves:
+                return []
+            found = [(_unpack_move(m), e) for m, e in moves.items()]
+        found = [(m, e) for m, e in found if board.is_legal(m)]
+        found.sort(key=lambda item: (item[1].score, item[1].games), reverse=True)
+        return found
+
+    def probe(self, board: chess.Board, min_games: int = 3, instant_score: float = 0.75,
+              known_factor: float = 0.5, min_eval: float = -50) -> Tuple[Optional[chess.Move], float]:
+        """
+        Decide how to use experience for `board`.
+        Returns (move, time_factor): move is set when the move is proven well enough to play
+        instantly; otherwise time_factor < 1.0 means the position is known and we can think less.
+        Both also require the move's average search eval to be at least `min_eval` (cp).
+        """
+        found = self.lookup(board)
+        if not found:
+            return None, 1.0
+        move, entry = found[0]
+        # ผลชนะจากไม่กี่เกมอาจเป็นโชค -> ต้องให้ eval ตอน search ยืนยันด้วย
+        if entry.games < min_games or entry.avg_eval < min_eval:
+            return None, 1.0
+        if entry.score >= instant_score:
+            return move, 0.0
+        if entry.score >= 0.5:
+            return None, known_factor
+        return None, 1.0
+
+    # -------------------------
+    # update
+    # -------------------------
+    def record_game(self, plies: Iterable[Tuple[int, str, Optional[int]]], result: float) -> int:
+        """
+        Record one finished game. `plies` holds (zobrist key, uci move, eval cp) for the moves
+        we played and `result` is our score (1 / 0.5 / 0). Returns number of positions stored.
+        """
+        stored = 0
+        with self._lock:
+            self.generation += 1
+            for key, uci, eval_cp in plies:
+                try:
+                    packed = _pack_move(chess.Move.from_uci(uci))
+                except Exception:
+                    continue
+                moves = self._entries.setdefault(key, {})
+                entry = moves.get(packed)
+                if entry is None:
+                    entry = moves[packed] = ExperienceEntry()
+                    self._size += 1
+                entry.add(result, eval_cp, self.generation)
+                stored += 1
+            if self._size > self.max_entries:
+                # ตัดเหลือ ~90% ของขนาดสูงสุด เพื่อไม่ให้ต้อง compact ทุกเกม
+                self._compact_locked(int(self.max_entries * 0.9))
+        return stored
+
+    def compact(self, target: Optional[int] = None) -> int:
+        """Drop the least useful entries until at most `target` remain. Returns entries removed."""
+        with self._lock:
+            return self._compact_locked(self.max_entries if target is None else max(0, int(target)))
+
+    def _compact_locked(self, target: int) -> int:
+        if self._size <= target:
+            return 0
+        flat = [(e.games, e.stamp, key, packed)
+                for key, moves in self._entries.items()
+                for packed, e in moves.items()]
+        flat.sort()
+        removed = 0
+        for _, _, key, packed in flat[:self._size - target]:
+            moves = self._entries[key]
+            del moves[packed]
+            if not moves:
+                del self._entries[key]
+            removed += 1
+        self._size -= removed
+        return removed
+
+    # -------------------------
+    # persistence
+    # -------------------------
+    def load(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            return
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, version, generation, count = _HEADER.unpack_from(data, 0)
+            if magic != _MAGIC or version != _VERSION:
+                print(f"[experience] {path}: unknown format; starting empty.")
+                return
+            entries: Dict[int, Dict[int, ExperienceEntry]] = {}
+            offset = _HEADER.size
+            for _ in range(count):
+                key, packed, games, wins, draws, losses, eval_sum, stamp = _RECORD.unpack_from(data, offset)
+                offset += _RECORD.size
+                entries.setdefault(key, {})[packed] = ExperienceEntry(games, wins, draws, losses, eval_sum, stamp)
+        except Exception as e:
+            print(f"[experience] failed to load {path}: {e}")
+            return
+        with self._lock:
+            self._entries = entries
+            self._size = count
+            self.generation = generation
+            if self._size > self.max_entries:
+                self._compact_locked(self.max_entries)
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the book atomically (tmp file + rename)."""
+        path = path or self.path
+        if not path:
+            return
+        with self._save_lock:
+            # ถือ lock แค่ตอน snapshot -> lookup() ของเกมอื่นไม่ต้องรอการ pack / เขียนไฟล์
+            with self._lock:
+                header = _HEADER.pack(_MAGIC, _VERSION, self.generation, self._size)
+                records = [(key, packed, e.games, e.wins, e.draws, e.losses, e.eval_sum, e.stamp)
+                           for key, moves in self._entries.items()
+                           for packed, e in moves.items()]
+            pack = _RECORD.pack
+            data = header + b"".join([pack(*r) for r in records])
+            tmp = f"{path}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except Exception as e:
+                print(f"[experience] failed to save {path}: {e}")
+
+    def save_async(self) -> None:
+        """Save from a background thread; requests made while one is waiting collapse into it."""
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        threading.Thread(target=self._save_worker, name="experience-save", daemon=True).start()
+
+    def _save_worker(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                self._save_pending = False
+            self.save()
+
+    # -------------------------
+    # offline rebuild
+    # -------------------------
+    def add_pgn_game(self, game: "chess.pgn.Game", player: Optional[str] = None, max_ply: int = 60) -> int:
+        """Feed one PGN game. If `player` is given only that side's moves are recorded."""
+        winner = {"1-0": "white", "0-1": "black", "1/2-1/2": None}.get(game.headers.get("Result", "*"), "unknown")
+        colors = [chess.WHITE, chess.BLACK]
+        if player:
+            colors = [c for c, tag in ((chess.WHITE, "White"), (chess.BLACK, "Black"))
+                      if game.headers.get(tag, "").lower() == player.lower()]
+        stored = 0
+        for color in colors:
+            result = _result_for(winner, color)
+            if result is None:
+                continue
+            plies = []
+            board = game.board()
+            for node in game.mainline():
+                if board.ply() >= max_ply:
+                    break
+                if board.turn == color:
+                    score = node.eval()
+                    # [%eval] ใน PGN เป็นมุมมองของฝ่ายขาว -> แปลงเป็นมุมมองฝ่ายที่เดิน
+                    eval_cp = score.pov(color).score(mate_score=_EVAL_CLAMP) if score is not None else None
+                    plies.append((chess.polyglot.zobrist_hash(board), node.move.uci(), eval_cp))
+                board.push(node.move)
+            stored += self.record_game(plies, result)
+        return stored
+
+
+def rebuild(out_path: str, pgn_paths: Iterable[str], player: Optional[str] = None,
+            max_entries: int = 200000, max_ply: int = 60) -> ExperienceBook:
+    """Rebuild an experience book from saved PGN files (offline)."""
+    import chess.pgn  # offline tool only; not needed by the bot at startup
+
+    book = ExperienceBook(max_entries=max_entries)
+    games = 0
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding="utf-8", errors="replace") as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                book.add_pgn_game(game, player=player, max_ply=max_ply)
+                games += 1
+    book.compact()
+    book.save(out_path)
+    print(f"[experience] rebuilt {out_path}: {games} games, {len(book)} entries")
+    return book
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Experience book tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_rebuild = sub.add_parser("rebuild", help="rebuild the book from PGN files")
+    p_rebuild.add_argument("pgn", nargs="+")
+    p_rebuild.add_argument("-o", "--output", default=None)
+    p_rebuild.add_argument("--player", default=None, help="only record moves of this player (bot username)")
+    p_rebuild.add_argument("--max-entries", type=int, default=None)
+
+    p_compact = sub.add_parser("compact", help="shrink an existing book")
+    p_compact.add_argument("--book", default=None)
+    p_compact.add_argument("--target", type=int, default=None)
+
+    args = parser.parse_args()
+    try:
+        from config import EXPERIENCE_PATH, EXPERIENCE_MAX_ENTRIES, EXPERIENCE_MAX_PLY
+    except ImportError:
+        EXPERIENCE_PATH, EXPERIENCE_MAX_ENTRIES, EXPERIENCE_MAX_PLY = "experience.bin", 200000, 60
+
+    if args.cmd == "rebuild":
+        rebuild(args.output or EXPERIENCE_PATH, args.pgn, player=args.player,
+                max_entries=args.max_entries or EXPERIENCE_MAX_ENTRIES, max_ply=EXPERIENCE_MAX_PLY)
+    elif args.cmd == "compact":
+        book = ExperienceBook(args.book or EXPERIENCE_PATH, max_entries=EXPERIENCE_MAX_ENTRIES)
+        removed = book.compact(args.target)
+        book.save()
+        print(f"[experience] removed {removed} entries, {len(book)} left")
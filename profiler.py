@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import functools
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from botlog import log
+
+try:
+    from config import PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MAX_DEPTH, PROFILE_CONTROL_PORT
+except ImportError:
+    PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MAX_DEPTH, PROFILE_CONTROL_PORT = "logs/profiles", 0.005, 64, 0
+
+
+# -------------------------
+# per-function timers
+# -------------------------
+class _Timer:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+_timers: Dict[str, _Timer] = {}
+_timers_lock = threading.Lock()
+_timers_enabled = False
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator: record call count / total / max wall time while profiling is enabled."""
+
+    def wrap(func: Callable) -> Callable:
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            if not _timers_enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                with _timers_lock:
+                    t = _timers.get(label)
+                    if t is None:
+                        t = _timers[label] = _Timer()
+                    t.count += 1
+                    t.total += elapsed
+                    if elapsed > t.max:
+                        t.max = elapsed
+
+        return inner
+
+    return wrap
+
+
+def timer_stats(reset: bool = False) -> Dict[str, Dict[str, float]]:
+    with _timers_lock:
+        stats = {
+            label: {
+                "count": t.count,
+                "total_ms": round(t.total * 1000, 3),
+                "mean_ms": round(t.total * 1000 / t.count, 3) if t.count else 0.0,
+                "max_ms": round(t.max * 1000, 3),
+            }
+            for label, t in _timers.items()
+        }
+        if reset:
+            _timers.clear()
+    return stats
+
+
+# -------------------------
+# sampling profiler
+# -------------------------
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every `interval` seconds from a background thread
+    and aggregates them as collapsed stacks ("thread;outer;...;inner count").
+    Threads blocked on engine I/O show up in their wait frames, so waits are visible too.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_depth: int = PROFILE_MAX_DEPTH) -> None:
+        self.interval = max(0.001, float(interval))
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self.started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # cache frame labels ต่อ code object -> ไม่ต้องสร้าง string ใหม่ทุก sample
+        self._labels: Dict[Any, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.samples.clear()
+        self._labels.clear()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _label(self, code: Any) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text (input for flamegraph.pl / speedscope)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def dump(self, directory: str = PROFILE_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"profile-{stamp}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(os.path.join(directory, f"timers-{stamp}.json"), "w", encoding="utf-8") as f:
+            json.dump(timer_stats(), f, indent=1)
+        return path
+
+
+_CONTROL_TIMEOUT = 2.0  # วินาที: client ที่ต่อแล้วไม่ส่งอะไร จะไม่บล็อก control socket
+
+_profiler = SamplingProfiler()
+_toggle_lock = threading.Lock()
+
+
+def enable() -> None:
+    global _timers_enabled
+    with _toggle_lock:
+        if _profiler.running:
+            return
+        timer_stats(reset=True)
+        _timers_enabled = True
+        _profiler.start()
+    log("profiler", f"[profiler] sampling every {_profiler.interval * 1000:.1f}ms")
+
+
+def disable() -> Optional[str]:
+    """Stop profiling and write collapsed stacks + timer stats. Returns the profile path."""
+    global _timers_enabled
+    with _toggle_lock:
+        if not _profiler.running:
+            return None
+        _profiler.stop()
+        _timers_enabled = False
+        samples = sum(_profiler.samples.values())
+        path = _profiler.dump()
+    log("profiler", f"[profiler] stopped: {samples} samples -> {path}", path=path, samples=samples)
+    return path
+
+
+def toggle() -> None:
+    if _profiler.running:
+        disable()
+    else:
+        enable()
+
+
+def dump_timers() -> Dict[str, Dict[str, float]]:
+    stats = timer_stats()
+    log("profiler", f"[profiler] timers: {stats}", timers=stats)
+    return stats
+
+
+# -------------------------
+# runtime control: signal / local socket
+# -------------------------
+_wake = threading.Event()
+_toggle_requested = threading.Event()
+_timers_requested = threading.Event()
+
+
+def _control_loop() -> None:
+    """Long-lived thread doing the work requested by the signal handler."""
+    while True:
+        _wake.wait()
+        _wake.clear()
+        if _toggle_requested.is_set():
+            _toggle_requested.clear()
+            toggle()
+        if _timers_requested.is_set():
+            _timers_requested.clear()
+            dump_timers()
+
+
+def _on_signal(signum: int, frame: Any) -> None:
+    # ใน signal handler แค่ set Event: หยุด profiler ต้อง join thread + เขียนไฟล์ และการสร้าง
+    # thread / log ต้องใช้ lock ที่ main thread อาจถืออยู่ -> ให้ profiler-control ทำแทน
+    if signum == getattr(signal, "SIGUSR1", None):
+        _toggle_requested.set()
+    else:
+        _timers_requested.set()
+    _wake.set()
+
+
+def _serve_control(port: int) -> None:
+    commands = {"start": enable, "stop": disable, "toggle": toggle, "timers": dump_timers}
+    try:
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(("127.0.0.1", port))
+        srv.listen(1)
+    except OSError as e:
+        log("profiler", f"[profiler] cannot open control socket on 127.0.0.1:{port}: {e}", level="warning")
+        return
+    log("profiler", f"[profiler] control socket on 127.0.0.1:{port}")
+    while True:
+        conn, _ = srv.accept()
+        with conn:
+            try:
+                conn.settimeout(_CONTROL_TIMEOUT)
+                cmd = conn.recv(64).decode("ascii", "ignore").strip()
+                func = commands.get(cmd)
+                reply = func() if func else f"unknown command {cmd!r}; use {sorted(commands)}"
+                conn.sendall((json.dumps(reply, default=str) + "\n").encode())
+            except Exception as e:
+                log("profiler", f"[profiler] control error: {e}", level="warning")
+
+
+def install(port: int = PROFILE_CONTROL_PORT) -> None:
+    """
+    SIGUSR1 toggles the sampling profiler, SIGUSR2 logs timer stats (POSIX). If `port` is
+    set, a 127.0.0.1 control socket accepts start / stop / toggle / timers as well.
+    """
+    threading.Thread(target=_control_loop, name="profiler-control", daemon=True).start()
+    for name in ("SIGUSR1", "SIGUSR2"):
+        sig = getattr(signal, name, None)
+        if sig is not None:
+            try:
+                signal.signal(sig, _on_signal)
+            except (ValueError, OSError):
+                pass
+    if port:
+        threading.Thread(target=_serve_control, args=(port,), name="profiler-socket", daemon=True).start()